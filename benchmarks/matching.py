@@ -0,0 +1,153 @@
+"""Сравнение пропускной способности сопоставления ключевых слов в
+цикле asyncio и в пуле процессов (services.match_pool).
+
+Запуск из корня проекта (нужен настроенный .env):
+    python -m benchmarks.matching --keywords 1000 10000 50000 --workers 4
+
+Для каждого размера списка выводится скорость (сообщений в секунду) и
+максимальная задержка цикла asyncio во время сопоставления."""
+import argparse
+import asyncio
+import random
+import string
+import time
+from typing import List, Tuple
+from services.keyword_matcher import KeywordMatcher
+from services.match_pool import MatchPool
+
+
+def random_word(rng: random.Random) -> str:
+    return "".join(
+        rng.choice(string.ascii_lowercase)
+        for _ in range(rng.randint(4, 10))
+    )
+
+
+def make_keywords(rng: random.Random, count: int) -> List[str]:
+    # Каждое пятое ключевое слово - фраза из нескольких слов
+    return [
+        " ".join(random_word(rng) for _ in range(rng.randint(2, 3)))
+        if i % 5 == 0 else random_word(rng)
+        for i in range(count)
+    ]
+
+
+def make_messages(
+    rng: random.Random,
+    keywords: List[str],
+    count: int,
+    hit_ratio: float
+) -> List[str]:
+    messages = []
+    for _ in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(10, 40))]
+        if rng.random() < hit_ratio:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        messages.append(" ".join(words))
+    return messages
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.001) -> float:
+    """Максимальное опоздание таймера цикла, пока не установлен stop"""
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - started - interval)
+    return worst
+
+
+async def run_in_loop(
+    matcher: KeywordMatcher,
+    messages: List[str]
+) -> Tuple[float, float]:
+    stop = asyncio.Event()
+    lag = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    # Как в мониторе: каждое сообщение - отдельный апдейт
+    for text in messages:
+        matcher.find_all(text)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    return len(messages) / elapsed, await lag
+
+
+async def run_pooled(
+    matcher: KeywordMatcher,
+    messages: List[str],
+    workers: int,
+    batch_size: int
+) -> Tuple[float, float]:
+    keywords = (0, matcher.keywords)
+    pool = MatchPool(workers, batch_size, 0.005, lambda: keywords)
+    pool.start()
+    try:
+        # Прогрев: запуск процессов и передача ключевых слов
+        await pool.find_all_many(messages[:workers * batch_size])
+
+        stop = asyncio.Event()
+        lag = asyncio.create_task(measure_lag(stop))
+        await asyncio.sleep(0)
+
+        # Сообщения подаются окнами, чтобы все процессы были заняты,
+        # но цикл не создавал тысячи задач за один шаг
+        window = workers * batch_size
+        started = time.perf_counter()
+        for start in range(0, len(messages), window):
+            await pool.find_all_many(messages[start:start + window])
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        return len(messages) / elapsed, await lag
+    finally:
+        pool.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--keywords",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000, 50000]
+    )
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--hit-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(
+        f"{'keywords':>9} | {'build, s':>8} | {'in-loop msg/s':>13} | "
+        f"{'lag, ms':>7} | {'pooled msg/s':>12} | {'lag, ms':>7}"
+    )
+    for count in args.keywords:
+        rng = random.Random(args.seed)
+        keywords = make_keywords(rng, count)
+        messages = make_messages(
+            rng, keywords, args.messages, args.hit_ratio
+        )
+
+        started = time.perf_counter()
+        matcher = KeywordMatcher(keywords)
+        build = time.perf_counter() - started
+
+        loop_rate, loop_lag = await run_in_loop(matcher, messages)
+        pool_rate, pool_lag = await run_pooled(
+            matcher, messages, args.workers, args.batch_size
+        )
+        print(
+            f"{count:>9} | {build:>8.2f} | {loop_rate:>13.0f} | "
+            f"{loop_lag * 1000:>7.1f} | {pool_rate:>12.0f} | "
+            f"{pool_lag * 1000:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
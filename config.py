@@ -12,11 +12,68 @@ class Settings(BaseSettings):
     ADMIN_ID: int
     API_ID: int
     API_HASH: str
+    EXTRA_SESSIONS: str = ""
+    POOL_BALANCE_POLICY: str = "count"
 
     DATA_FILE: str = "data.json"
+    DATABASE_FILE: str = "data.db"
+    STORAGE_ENGINE: str = "sqlite"
+    WRITE_BEHIND: bool = False
+    WRITE_BEHIND_INTERVAL: float = 2.0
+    SOURCE_STATE_SAVE_INTERVAL: float = 10.0
     MAX_MESSAGES_PER_REQUEST: int = 100
     HISTORY_MESSAGES_LIMIT: int = 5000
     BATCH_DELAY: float = 1.0
+    HISTORY_MIN_DELAY: float = 0.2
+    HISTORY_MAX_DELAY: float = 30.0
+    HISTORY_MAX_FLOOD_WAIT: int = 3600
+    HISTORY_PREFETCH: int = 2
+    HISTORY_CONCURRENCY: int = 2
+
+    ENTITY_CACHE_SIZE: int = 5000
+    ENTITY_CACHE_TTL: float = 3600.0
+
+    INGESTION_QUEUE_SIZE: int = 1000
+    INGESTION_WORKERS: int = 4
+    INGESTION_OVERFLOW_POLICY: str = "block"
+    INGESTION_MAX_IN_FLIGHT: int = 2000
+
+    NOTIFY_GLOBAL_RATE: float = 30.0
+    NOTIFY_CHAT_RATE: float = 1.0
+    NOTIFY_CHAT_BURST: float = 3.0
+    NOTIFY_MAX_RETRIES: int = 5
+
+    OUTBOX_FILE: str = "outbox.db"
+    OUTBOX_BATCH_SIZE: int = 50
+    OUTBOX_POLL_INTERVAL: float = 5.0
+    OUTBOX_MAX_ATTEMPTS: int = 10
+
+    ARCHIVE_ENABLED: bool = True
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_BLOCK_SIZE: int = 500
+    ARCHIVE_SEGMENT_BYTES: int = 16 * 1024 * 1024
+    ARCHIVE_FLUSH_INTERVAL: float = 10.0
+
+    BACKFILL_ENABLED: bool = True
+    BACKFILL_DELAY: float = 10.0
+
+    DEDUP_FILE: str = "dedup.json"
+    DEDUP_MAX_ENTRIES: int = 50000
+    DEDUP_TEXT_WINDOW: float = 0.0
+    DEDUP_SAVE_INTERVAL: float = 30.0
+
+    GAP_RECOVERY_ENABLED: bool = True
+    GAP_RECOVERY_INTERVAL: float = 300.0
+    GAP_RECOVERY_CHECK_INTERVAL: float = 5.0
+    GAP_DIFFERENCE_LIMIT: int = 100
+
+    MONITOR_EDITS: bool = True
+    EDIT_CACHE_SIZE: int = 20000
+
+    MATCH_WORKERS: int = 0
+    MATCH_BATCH_SIZE: int = 64
+    MATCH_BATCH_DELAY: float = 0.005
+    MATCH_TIMEOUT: float = 10.0
 
 
 settings = Settings()
\ No newline at end of file
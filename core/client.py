@@ -1,3 +1,5 @@
+import time
+from typing import Dict, List, Optional
 from telethon import TelegramClient
 from config import settings
 from core.database import data_manager
@@ -49,4 +51,161 @@ def get_client():
 
 def set_client(new_client):
     global client
-    client = new_client
\ No newline at end of file
+    client = new_client
+
+
+PRIMARY_ACCOUNT = "main"
+BALANCE_POLICIES = ("count", "rate")
+
+
+class ClientPool:
+    """Аккаунты Telethon, между которыми распределяются источники.
+
+    Основной аккаунт (get_client) всегда называется PRIMARY_ACCOUNT,
+    дополнительные - по файлу сессии из EXTRA_SESSIONS. Источник без
+    назначенного аккаунта принадлежит основному. Новый источник
+    получает наименее загруженный аккаунт: по числу источников (count)
+    или по числу сообщений из его источников (rate)."""
+
+    def __init__(self, policy: str):
+        if policy not in BALANCE_POLICIES:
+            raise ValueError(f"Unknown balance policy: {policy}")
+
+        self.policy = policy
+        self._clients: Dict[str, TelegramClient] = {}
+        self._owners: Dict[int, str] = {}
+        self._message_counts: Dict[int, int] = {}
+        self.started_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return 1 + len(self._clients)
+
+    @property
+    def accounts(self) -> List[str]:
+        return [PRIMARY_ACCOUNT] + list(self._clients)
+
+    def add(self, account: str, new_client: TelegramClient):
+        self._clients[account] = new_client
+
+    def get(self, account: str) -> Optional[TelegramClient]:
+        if account == PRIMARY_ACCOUNT:
+            return get_client()
+        return self._clients.get(account)
+
+    def load_owners(self):
+        self._owners = {
+            int(source_id): source["account"]
+            for source_id, source in data_manager.get_data()["sources"].items()
+            if source.get("account")
+        }
+
+    def account_of(self, source_id: int) -> str:
+        return self._owners.get(source_id, PRIMARY_ACCOUNT)
+
+    def serving_account(self, source_id: int) -> str:
+        """Аккаунт, который обслуживает источник: владелец, а при его
+        отключении или удалении из EXTRA_SESSIONS - основной"""
+        account = self.account_of(int(source_id))
+        owner = self.get(account)
+        if owner is not None and owner.is_connected():
+            return account
+        return PRIMARY_ACCOUNT
+
+    def client_for(self, source_id: int) -> Optional[TelegramClient]:
+        return self.get(self.serving_account(source_id))
+
+    def served_by(self, account: str) -> List[int]:
+        return [
+            source_id for source_id in data_manager.monitored_chat_ids
+            if self.serving_account(source_id) == account
+        ]
+
+    def assign(self, source_id: int, account: str):
+        source_id = int(source_id)
+        self._owners[source_id] = account
+        data_manager.set_source_account(source_id, account)
+
+    def sources_of(self, account: str) -> List[int]:
+        return [
+            source_id for source_id in data_manager.monitored_chat_ids
+            if self.account_of(source_id) == account
+        ]
+
+    def record_message(self, source_id: int):
+        self._message_counts[source_id] = (
+            self._message_counts.get(source_id, 0) + 1
+        )
+
+    def get_load(self, account: str) -> float:
+        sources = self.sources_of(account)
+        if self.policy == "count":
+            return len(sources)
+        return sum(self._message_counts.get(sid, 0) for sid in sources)
+
+    def pick_account(self) -> str:
+        connected = [
+            account for account in self.accounts
+            if self.get(account) is not None and
+            self.get(account).is_connected()
+        ]
+        if not connected:
+            return PRIMARY_ACCOUNT
+        return min(connected, key=self.get_load)
+
+    def get_stats(self) -> List[Dict]:
+        elapsed = max(time.monotonic() - self.started_at, 1.0)
+        stats = []
+        for account in self.accounts:
+            account_client = self.get(account)
+            sources = self.sources_of(account)
+            messages = sum(
+                self._message_counts.get(sid, 0) for sid in sources
+            )
+            stats.append({
+                "account": account,
+                "connected": bool(
+                    account_client and account_client.is_connected()
+                ),
+                "sources": len(sources),
+                "messages": messages,
+                "rate": messages / elapsed,
+            })
+        return stats
+
+
+client_pool = ClientPool(settings.POOL_BALANCE_POLICY)
+
+
+async def init_pool():
+    """Подключает дополнительные аккаунты из EXTRA_SESSIONS"""
+    client_pool.load_owners()
+
+    sessions = [
+        session.strip()
+        for session in settings.EXTRA_SESSIONS.split(",")
+        if session.strip()
+    ]
+    for session_file in sessions:
+        try:
+            extra_client = TelegramClient(
+                session_file,
+                settings.API_ID,
+                settings.API_HASH,
+                device_model="Telegram Bot",
+                system_version="1.0",
+                app_version="1.0",
+                lang_code="ru",
+            )
+            await extra_client.connect()
+            if not await extra_client.is_user_authorized():
+                logger.error(f"Extra account {session_file} not authorized")
+                await extra_client.disconnect()
+                continue
+        except Exception as e:
+            logger.error(f"Extra account {session_file} error: {e}")
+            continue
+
+        client_pool.add(session_file, extra_client)
+        logger.info(f"Extra account {session_file} connected")
+
+    return client_pool
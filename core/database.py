@@ -1,12 +1,22 @@
-import json
-from typing import Dict, List, Optional
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 from config import settings
+from core.storage import create_storage
 from utils.logger import logger
 
 
 class DataManager:
     _instance = None
     _data = None
+    _keywords_version = 0
+    _source_ids = None
+    _pending = None
+    _dirty = None
+    _state_dirty = None
+    _flush_lock = None
 
     def __new__(cls):
         if cls._instance is None:
@@ -15,11 +25,17 @@ class DataManager:
         return cls._instance
 
     def _load_data(self):
-        try:
-            with open(settings.DATA_FILE, "r", encoding="utf-8") as f:
-                self._data = json.load(f)
-                logger.info("Data loaded successfully")
-        except (FileNotFoundError, json.JSONDecodeError):
+        self._storage = create_storage(
+            settings.STORAGE_ENGINE,
+            settings.DATABASE_FILE,
+            settings.DATA_FILE
+        )
+        self._pending = {}
+        self._state_dirty = set()
+        self._data = self._storage.load()
+        if self._data is not None:
+            logger.info("Data loaded successfully")
+        else:
             self._data = {
                 "sources": {},
                 "keywords": [],
@@ -35,9 +51,115 @@ class DataManager:
             self.save_data()
             logger.info("Created new data file")
 
+        self._source_ids = {int(sid) for sid in self._data["sources"]}
+
     def save_data(self):
-        with open(settings.DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        self._storage.save_all(self._data)
+
+    def _persist(self, operation: str, key, *args):
+        if not settings.WRITE_BEHIND:
+            getattr(self._storage, operation)(key, *args)
+            return
+
+        # Для каждого ключа важна только последняя операция, при повторе
+        # она переносится в конец, чтобы сохранить порядок применения
+        self._pending.pop((operation, key), None)
+        self._pending[(operation, key)] = (key, *args)
+        if self._dirty is not None:
+            self._dirty.set()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            operations = list(self._pending.items())
+            self._pending.clear()
+            snapshot = self._storage.snapshot(self._data, operations)
+
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(
+                    None, self._storage.write, snapshot
+                )
+            except Exception as e:
+                logger.error(f"Error saving data: {e}")
+                # Неудачные операции возвращаются в начало очереди,
+                # более новые операции остаются после них
+                retry = dict(operations)
+                for operation_key, args in self._pending.items():
+                    retry.pop(operation_key, None)
+                    retry[operation_key] = args
+                self._pending = retry
+                raise
+
+    async def run_write_behind(self):
+        if not settings.WRITE_BEHIND:
+            return
+
+        logger.info("Write-behind persistence enabled")
+        self._dirty = asyncio.Event()
+        if self._pending:
+            self._dirty.set()
+
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(settings.WRITE_BEHIND_INTERVAL)
+            self._dirty.clear()
+            try:
+                await self.flush()
+            except Exception:
+                self._dirty.set()
+
+    def _mark_source_state(self, source_id: int):
+        # Позиция источника меняется с каждым сообщением, поэтому она
+        # хранится в памяти и сохраняется пачкой в run_source_state_persist
+        self._state_dirty.add(str(source_id))
+
+    async def flush_source_state(self):
+        dirty = self._state_dirty
+        self._state_dirty = set()
+        operations = []
+        for source_id in dirty:
+            source = self._data["sources"].get(source_id)
+            if source is not None:
+                operations.append(
+                    (("save_source", source_id), (source_id, source))
+                )
+
+        if not settings.WRITE_BEHIND:
+            # Без write-behind остальные изменения пишутся синхронно из
+            # цикла; запись из потока могла бы пересечься с ними в одном
+            # файле (json), поэтому пачка тоже пишется здесь
+            try:
+                self._storage.write(
+                    self._storage.snapshot(self._data, operations)
+                )
+            except Exception as e:
+                logger.error(f"Error saving source state: {e}")
+                self._state_dirty |= dirty
+                raise
+            return
+
+        for operation_key, args in operations:
+            self._pending.pop(operation_key, None)
+            self._pending[operation_key] = args
+        await self.flush()
+
+    async def run_source_state_persist(self):
+        while True:
+            await asyncio.sleep(settings.SOURCE_STATE_SAVE_INTERVAL)
+            if not self._state_dirty:
+                continue
+            try:
+                await self.flush_source_state()
+            except Exception:
+                # Операции остались в очереди и повторятся при
+                # следующем сохранении
+                pass
 
     def get_data(self) -> Dict:
         return self._data
@@ -48,7 +170,7 @@ class DataManager:
     def add_admin(self, admin_id: int) -> bool:
         if admin_id not in self._data["settings"]["admins"]:
             self._data["settings"]["admins"].append(admin_id)
-            self.save_data()
+            self._persist("add_admin", admin_id)
             return True
         return False
 
@@ -56,7 +178,7 @@ class DataManager:
         if (admin_id in self._data["settings"]["admins"] and
                 admin_id != settings.ADMIN_ID):
             self._data["settings"]["admins"].remove(admin_id)
-            self.save_data()
+            self._persist("remove_admin", admin_id)
             return True
         return False
 
@@ -84,55 +206,292 @@ class DataManager:
                 self._data["sources"][str(source_id)][
                     "parent_channel"
                 ] = parent_channel
-            self.save_data()
+            self._persist(
+                "save_source",
+                str(source_id),
+                self._data["sources"][str(source_id)]
+            )
+            self._source_ids.add(int(source_id))
             return True
         return False
 
     def remove_source(self, source_id: str) -> bool:
         if source_id in self._data["sources"]:
             del self._data["sources"][source_id]
-            self.save_data()
+            self._source_ids.discard(int(source_id))
+            self._state_dirty.discard(source_id)
+            self._persist("delete_source", source_id)
             return True
         return False
 
-    def mark_source_processed(self, source_id: int):
-        if str(source_id) in self._data["sources"]:
-            self._data["sources"][str(source_id)]["processed"] = True
-            self.save_data()
+    def mark_source_processed(self, source_id: int, processed: bool = True):
+        source = self._data["sources"].get(str(source_id))
+        if source is not None:
+            source["processed"] = processed
+            self._persist("save_source", str(source_id), source)
 
     def is_source_processed(self, source_id: int) -> bool:
         return self._data["sources"].get(
             str(source_id), {}
         ).get("processed", False)
 
+    def mark_source_archived(self, source_id: int):
+        """Архив источника содержит всю историю, доступную сканированию"""
+        source = self._data["sources"].get(str(source_id))
+        if source is not None and not source.get("archived"):
+            source["archived"] = True
+            self._persist("save_source", str(source_id), source)
+
+    def is_source_archived(self, source_id: int) -> bool:
+        return self._data["sources"].get(
+            str(source_id), {}
+        ).get("archived", False)
+
+    def get_source_watermark(self, source_id: int) -> int:
+        return self._data["sources"].get(
+            str(source_id), {}
+        ).get("last_message_id", 0)
+
+    def update_source_watermark(self, source_id: int, message_id: int):
+        source = self._data["sources"].get(str(source_id))
+        if source is None:
+            return
+        if message_id <= source.get("last_message_id", 0):
+            return
+        source["last_message_id"] = message_id
+        self._mark_source_state(source_id)
+
+    def set_source_account(self, source_id: int, account: str):
+        source = self._data["sources"].get(str(source_id))
+        if source is not None and source.get("account") != account:
+            source["account"] = account
+            self._persist("save_source", str(source_id), source)
+
+    def get_source_pts(self, source_id: int) -> Optional[int]:
+        return self._data["sources"].get(str(source_id), {}).get("pts")
+
+    def update_source_pts(self, source_id: int, pts: int):
+        source = self._data["sources"].get(str(source_id))
+        if source is None or pts <= source.get("pts", 0):
+            return
+        source["pts"] = pts
+        self._mark_source_state(source_id)
+
+    def get_history_checkpoint(self, source_id: int) -> Optional[Dict]:
+        return self._data["sources"].get(
+            str(source_id), {}
+        ).get("history_checkpoint")
+
+    def save_history_checkpoint(self, source_id: int, checkpoint: Dict):
+        source = self._data["sources"].get(str(source_id))
+        if source is not None:
+            source["history_checkpoint"] = checkpoint
+            self._persist("save_source", str(source_id), source)
+
+    def clear_history_checkpoint(self, source_id: int):
+        source = self._data["sources"].get(str(source_id))
+        if source is not None and source.pop("history_checkpoint", None):
+            self._persist("save_source", str(source_id), source)
+
+    def get_checkpointed_source_ids(self) -> List[int]:
+        return [
+            int(sid) for sid, source in self._data["sources"].items()
+            if source.get("history_checkpoint")
+        ]
+
     def get_all_source_ids(self) -> List[int]:
         return [int(sid) for sid in self._data["sources"].keys()]
 
+    @property
+    def monitored_chat_ids(self) -> Set[int]:
+        """Живое множество id источников, обновляется при добавлении и
+        удалении источника"""
+        return self._source_ids
+
     def add_keyword(self, keyword: str) -> bool:
         if keyword.lower() not in [
             k.lower() for k in self._data["keywords"]
         ]:
             self._data["keywords"].append(keyword)
-            self.save_data()
+            self._keywords_version += 1
+            self._persist("add_keyword", keyword)
             return True
         return False
 
     def remove_keyword(self, index: int) -> Optional[str]:
         if 0 <= index < len(self._data["keywords"]):
             keyword = self._data["keywords"].pop(index)
-            self.save_data()
+            self._keywords_version += 1
+            self._persist("remove_keyword", keyword)
             return keyword
         return None
 
     def get_keywords(self) -> List[str]:
         return self._data["keywords"]
 
+    @property
+    def keywords_version(self) -> int:
+        return self._keywords_version
+
     def update_setting(self, key: str, value):
         self._data["settings"][key] = value
-        self.save_data()
+        self._persist("save_setting", key, value)
 
     def get_setting(self, key: str):
         return self._data["settings"].get(key)
 
 
-data_manager = DataManager()
\ No newline at end of file
+data_manager = DataManager()
+
+
+class OutboxItem(NamedTuple):
+    id: int
+    chat_id: int
+    text: str
+    reply_markup: Optional[str]
+    attempts: int
+
+
+class Outbox:
+    """Постоянная очередь уведомлений (доставка хотя бы один раз).
+
+    Записи, поставленные одновременно, фиксируются одной транзакцией,
+    то есть одним fsync на пачку."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: List[Tuple[list, asyncio.Future]] = []
+        self._commit_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "chat_id INTEGER NOT NULL, "
+                "text TEXT NOT NULL, "
+                "reply_markup TEXT, "
+                "created_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "next_attempt_at REAL NOT NULL DEFAULT 0)"
+            )
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _get_wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    async def enqueue_many(
+        self,
+        items: List[Tuple[int, str, Optional[str]]]
+    ):
+        if not items:
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((items, future))
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit())
+        await future
+
+    async def _commit(self):
+        while self._pending:
+            batch = self._pending
+            self._pending = []
+            rows = [row for items, _ in batch for row in items]
+
+            try:
+                await self._run(self._insert, rows)
+            except Exception as e:
+                logger.error(f"Error writing outbox batch: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+                self._get_wakeup().set()
+
+    def _insert(self, rows: List[Tuple[int, str, Optional[str]]]):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO outbox (chat_id, text, reply_markup, "
+                "created_at) VALUES (?, ?, ?, ?)",
+                [(chat_id, text, markup, now)
+                 for chat_id, text, markup in rows]
+            )
+
+    async def fetch(self, limit: int) -> List[OutboxItem]:
+        return await self._run(self._fetch, limit)
+
+    def _fetch(self, limit: int) -> List[OutboxItem]:
+        rows = self._connect().execute(
+            "SELECT id, chat_id, text, reply_markup, attempts FROM outbox "
+            "WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (time.time(), limit)
+        ).fetchall()
+        return [OutboxItem(*row) for row in rows]
+
+    async def ack(self, ids: List[int]):
+        if ids:
+            await self._run(self._ack, ids)
+
+    def _ack(self, ids: List[int]):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "DELETE FROM outbox WHERE id = ?",
+                [(item_id,) for item_id in ids]
+            )
+
+    async def retry_later(self, ids: List[int], delay: float):
+        if ids:
+            await self._run(self._retry_later, ids, delay)
+
+    def _retry_later(self, ids: List[int], delay: float):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, "
+                "next_attempt_at = ? WHERE id = ?",
+                [(time.time() + delay, item_id) for item_id in ids]
+            )
+
+    async def count(self) -> int:
+        return await self._run(
+            lambda: self._connect().execute(
+                "SELECT COUNT(*) FROM outbox"
+            ).fetchone()[0]
+        )
+
+    async def wait(self, timeout: float):
+        wakeup = self._get_wakeup()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+
+outbox = Outbox(settings.OUTBOX_FILE)
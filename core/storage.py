@@ -0,0 +1,324 @@
+import copy
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+from utils.logger import logger
+
+
+Operation = Tuple[Tuple[str, object], tuple]
+
+
+def write_file_atomic(path: str, payload: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # fsync каталога, чтобы переименование пережило сбой питания
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+SOURCE_COLUMNS = (
+    "type",
+    "title",
+    "username",
+    "processed",
+    "discussion_chat_id",
+    "parent_channel",
+)
+
+
+class JsonStorage:
+    """Хранит все данные одним JSON файлом, любое изменение
+    перезаписывает файл целиком"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data: Optional[Dict] = None
+
+    def load(self) -> Optional[Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return self._data
+
+    def save_all(self, data: Dict):
+        self._data = data
+        self.write(self.snapshot(data, []))
+
+    def snapshot(self, data: Dict, operations: List[Operation]) -> str:
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def write(self, payload: str):
+        write_file_atomic(self.path, payload)
+
+    def _save(self):
+        if self._data is not None:
+            self.save_all(self._data)
+
+    def save_source(self, source_id: str, source: Dict):
+        self._save()
+
+    def delete_source(self, source_id: str):
+        self._save()
+
+    def add_keyword(self, keyword: str):
+        self._save()
+
+    def remove_keyword(self, keyword: str):
+        self._save()
+
+    def save_setting(self, key: str, value):
+        self._save()
+
+    def add_admin(self, admin_id: int):
+        self._save()
+
+    def remove_admin(self, admin_id: int):
+        self._save()
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """SQLite в режиме WAL: изменения пишутся построчно, без
+    перезаписи всего состояния"""
+
+    def __init__(self, path: str, json_path: Optional[str] = None):
+        self.path = path
+        self.json_path = json_path
+        self._conn = sqlite3.connect(
+            path,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                id INTEGER PRIMARY KEY,
+                type TEXT NOT NULL,
+                title TEXT NOT NULL,
+                username TEXT,
+                processed INTEGER NOT NULL DEFAULT 0,
+                discussion_chat_id INTEGER,
+                parent_channel INTEGER,
+                extra TEXT
+            );
+            CREATE TABLE IF NOT EXISTS keywords (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                keyword TEXT NOT NULL UNIQUE COLLATE NOCASE
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS admins (
+                id INTEGER PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+
+    def _is_initialized(self) -> bool:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'initialized'"
+        ).fetchone()
+        return row is not None
+
+    def load(self) -> Optional[Dict]:
+        if not self._is_initialized():
+            return self._migrate_from_json()
+
+        data = {"sources": {}, "keywords": [], "settings": {}}
+
+        rows = self._conn.execute(
+            "SELECT id, type, title, username, processed, "
+            "discussion_chat_id, parent_channel, extra FROM sources "
+            "ORDER BY rowid"
+        )
+        for row in rows:
+            source = {
+                "type": row[1],
+                "title": row[2],
+                "username": row[3],
+                "processed": bool(row[4]),
+            }
+            if row[5] is not None:
+                source["discussion_chat_id"] = row[5]
+            if row[6] is not None:
+                source["parent_channel"] = row[6]
+            if row[7]:
+                source.update(json.loads(row[7]))
+            data["sources"][str(row[0])] = source
+
+        data["keywords"] = [
+            row[0] for row in self._conn.execute(
+                "SELECT keyword FROM keywords ORDER BY id"
+            )
+        ]
+
+        for key, value in self._conn.execute(
+            "SELECT key, value FROM settings"
+        ):
+            data["settings"][key] = json.loads(value)
+
+        data["settings"]["admins"] = [
+            row[0] for row in self._conn.execute(
+                "SELECT id FROM admins ORDER BY rowid"
+            )
+        ]
+        return data
+
+    def _migrate_from_json(self) -> Optional[Dict]:
+        if not self.json_path:
+            return None
+
+        data = JsonStorage(self.json_path).load()
+        if data is None:
+            return None
+
+        self.save_all(data)
+        logger.info(f"Data migrated from {self.json_path} to {self.path}")
+        return data
+
+    def save_all(self, data: Dict):
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM sources")
+            self._conn.execute("DELETE FROM keywords")
+            self._conn.execute("DELETE FROM settings")
+            self._conn.execute("DELETE FROM admins")
+
+            for source_id, source in data["sources"].items():
+                self._upsert_source(source_id, source)
+            for keyword in data["keywords"]:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO keywords (keyword) VALUES (?)",
+                    (keyword,)
+                )
+            for key, value in data["settings"].items():
+                if key != "admins":
+                    self._upsert_setting(key, value)
+            for admin_id in data["settings"].get("admins", []):
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO admins (id) VALUES (?)",
+                    (admin_id,)
+                )
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('initialized', '1')"
+            )
+
+    def snapshot(
+        self,
+        data: Dict,
+        operations: List[Operation]
+    ) -> List[Tuple[str, tuple]]:
+        return [
+            (key[0], copy.deepcopy(args)) for key, args in operations
+        ]
+
+    def write(self, operations: List[Tuple[str, tuple]]):
+        with self._conn:
+            self._conn.execute("BEGIN")
+            for name, args in operations:
+                getattr(self, name)(*args)
+
+    def _upsert_source(self, source_id: str, source: Dict):
+        extra = {
+            key: value for key, value in source.items()
+            if key not in SOURCE_COLUMNS
+        }
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sources (id, type, title, username, "
+            "processed, discussion_chat_id, parent_channel, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                int(source_id),
+                source["type"],
+                source["title"],
+                source.get("username"),
+                int(bool(source.get("processed", False))),
+                source.get("discussion_chat_id"),
+                source.get("parent_channel"),
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+            )
+        )
+
+    def _upsert_setting(self, key: str, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+    def save_source(self, source_id: str, source: Dict):
+        self._upsert_source(source_id, source)
+
+    def delete_source(self, source_id: str):
+        self._conn.execute(
+            "DELETE FROM sources WHERE id = ?",
+            (int(source_id),)
+        )
+
+    def add_keyword(self, keyword: str):
+        self._conn.execute(
+            "INSERT OR IGNORE INTO keywords (keyword) VALUES (?)",
+            (keyword,)
+        )
+
+    def remove_keyword(self, keyword: str):
+        self._conn.execute(
+            "DELETE FROM keywords WHERE keyword = ?",
+            (keyword,)
+        )
+
+    def save_setting(self, key: str, value):
+        self._upsert_setting(key, value)
+
+    def add_admin(self, admin_id: int):
+        self._conn.execute(
+            "INSERT OR IGNORE INTO admins (id) VALUES (?)",
+            (admin_id,)
+        )
+
+    def remove_admin(self, admin_id: int):
+        self._conn.execute(
+            "DELETE FROM admins WHERE id = ?",
+            (admin_id,)
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+def create_storage(engine: str, database_file: str, data_file: str):
+    if engine == "json":
+        return JsonStorage(data_file)
+    if engine == "sqlite":
+        return SqliteStorage(database_file, json_path=data_file)
+    raise ValueError(f"Unknown storage engine: {engine}")
@@ -1,6 +1,7 @@
 from aiogram import types, F
 from aiogram.fsm.context import FSMContext
 from core.bot import dp
+from config import settings
 from core.database import data_manager
 from keyboards.inline import (
     get_keywords_menu,
@@ -9,6 +10,7 @@ from keyboards.inline import (
 )
 from utils.states import AdminStates
 from filters.admin import AdminFilter
+from services.backfill import keyword_backfill
 
 
 @dp.callback_query(F.data == "manage_keywords", AdminFilter())
@@ -43,6 +45,12 @@ async def process_add_keyword(
 
     if data_manager.add_keyword(keyword):
         await message.answer(f"✅ Ключевое слово '{keyword}' добавлено!")
+        if settings.BACKFILL_ENABLED:
+            keyword_backfill.schedule(keyword, message.from_user.id)
+            await message.answer(
+                "⏳ Поиск прошлых совпадений для нового слова "
+                "запустится автоматически."
+            )
     else:
         await message.answer(
             f"⚠️ Ключевое слово '{keyword}' уже существует!"
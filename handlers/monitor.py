@@ -1,59 +1,297 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 from telethon import events
-from core.client import get_client
+from telethon.tl.types import (
+    Message,
+    PeerChannel,
+    PeerChat,
+    PeerUser,
+    UpdateEditChannelMessage,
+    UpdateEditMessage,
+    UpdateNewChannelMessage,
+    UpdateNewMessage,
+    UpdateShortChatMessage
+)
+from config import settings
+from core.client import PRIMARY_ACCOUNT, client_pool, get_client
 from core.database import data_manager
-from core.bot import bot
-from services.keyword_matcher import find_keyword_in_text
-from services.notification import format_notification
+from services.archive import message_archive
+from services.dedup import notification_dedup
+from services.keyword_matcher import KeywordHit
+from services.match_pool import match_text
+from services.notification import (
+    enqueue_notification,
+    format_notification
+)
+from services.entity_cache import entity_cache, get_message_link
+from services.ingestion import ingestion_queue
+from services.source_progress import source_progress
 from utils.logger import logger
 
 
-async def get_message_link(client, message) -> str:
-    try:
-        chat = await client.get_entity(message.chat_id)
-        username = getattr(chat, "username", None)
-
-        if username:
-            return f"https://t.me/{username}/{message.id}"
-        else:
-            chat_id_str = str(message.chat_id).replace("-100", "")
-            return f"https://t.me/c/{chat_id_str}/{message.id}"
-    except Exception:
+def peer_chat_id(peer) -> Optional[int]:
+    """Marked id чата (как у message.chat_id) без обращения к utils"""
+    if isinstance(peer, PeerChannel):
+        return -1000000000000 - peer.channel_id
+    if isinstance(peer, PeerChat):
+        return -peer.chat_id
+    if isinstance(peer, PeerUser):
+        return peer.user_id
+    return None
+
+
+class SeenTextCache:
+    """Хеши последних известных текстов сообщений (LRU).
+
+    Telegram присылает правки и при изменении реакций или просмотров,
+    такие правки без изменения текста не сопоставляются повторно"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def update(self, chat_id: int, message_id: int, text: str) -> bool:
+        """Запоминает текст, возвращает True, если он изменился"""
+        key = (chat_id, message_id)
+        text_hash = hash(text)
+        changed = self._entries.get(key) != text_hash
+        self._entries[key] = text_hash
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return changed
+
+
+seen_texts = SeenTextCache(settings.EDIT_CACHE_SIZE)
+
+
+def short_chat_message(update: UpdateShortChatMessage) -> Message:
+    """Сообщение обычной группы из сокращенного апдейта, как его
+    собирает events.NewMessage"""
+    return Message(
+        out=update.out,
+        mentioned=update.mentioned,
+        media_unread=update.media_unread,
+        silent=update.silent,
+        id=update.id,
+        from_id=PeerUser(update.from_id),
+        peer_id=PeerChat(update.chat_id),
+        message=update.message,
+        date=update.date,
+        fwd_from=update.fwd_from,
+        via_bot_id=update.via_bot_id,
+        reply_to=update.reply_to,
+        entities=update.entities,
+        ttl_period=update.ttl_period
+    )
+
+
+def update_pts(update) -> Tuple[Optional[int], int]:
+    """pts и pts_count апдейта канала, у обычных групп общий pts
+    аккаунта"""
+    if isinstance(update, (UpdateNewChannelMessage, UpdateEditChannelMessage)):
+        return update.pts, update.pts_count
+    return None, 0
+
+
+def accept_update(
+    update,
+    account: str
+) -> Optional[Tuple[object, int, str]]:
+    """Отсекает чужие чаты и пустые тексты по сырому апдейту.
+    Сообщение источника принимается только от обслуживающего его
+    аккаунта (владельца или основного, если владелец отключен)"""
+    short = isinstance(update, UpdateShortChatMessage)
+    if short:
+        chat_id = -update.chat_id
+        text = update.message
+    else:
+        message = update.message
+        chat_id = peer_chat_id(getattr(message, "peer_id", None))
+        text = getattr(message, "message", None)
+    if chat_id not in data_manager.monitored_chat_ids:
+        return None
+    if client_pool.serving_account(chat_id) != account:
         return None
 
+    # Пропуски внутри сессии Telethon закрывает сам, поэтому
+    # восстановлению нужен только pts последнего полученного апдейта.
+    # Апдейты без обработки сдвигают его сразу, остальные - после
+    # обработки (source_progress)
+    settings_data = data_manager.get_data()["settings"]
+    if (
+        not text or
+        not settings_data["is_running"] or
+        not settings_data["notifications"]
+    ):
+        source_progress.advance(chat_id, pts=update_pts(update)[0])
+        return None
 
-async def handle_new_message(event):
-    try:
-        data = data_manager.get_data()
+    if short:
+        message = short_chat_message(update)
+    return message, chat_id, text
 
-        if not data["settings"]["is_running"]:
-            return
 
-        if not data["settings"]["notifications"]:
+async def handle_raw_update(update, account: str = PRIMARY_ACCOUNT):
+    """Быстрый путь для новых сообщений.
+
+    Чужие чаты, пустые тексты и сообщения без совпадений отсекаются по
+    сырому апдейту, полный объект Message (сущности, отправитель)
+    собирается только для совпадений"""
+    try:
+        accepted = accept_update(update, account)
+        if accepted is None:
+            return
+        if not ingestion_queue.admit():
             return
+        try:
+            await accept_new_message(update, account, *accepted)
+        finally:
+            ingestion_queue.release()
 
-        message = event.message
-        chat_id = message.chat_id
+    except Exception as e:
+        logger.error(f"Error in message handler: {e}")
 
-        if str(chat_id) not in data["sources"]:
+
+async def accept_new_message(update, account, message, chat_id, text):
+    client_pool.record_message(chat_id)
+    seen_texts.update(chat_id, message.id, text)
+
+    # Позиция источника не сдвигается за сообщение, пока оно не
+    # обработано: совпадение может ждать в очереди до сбоя
+    token = source_progress.begin(chat_id, message.id, *update_pts(update))
+    queued = False
+    try:
+        with ingestion_queue.timed("match"):
+            hits = await match_text(text)
+
+        if not hits:
+            message_archive.add(chat_id, [message])
             return
 
-        text = getattr(message, "message", None)
-        if not text:
+        message._finish_init(
+            client_pool.get(account),
+            getattr(update, "_entities", None) or {},
+            None
+        )
+        queued = await ingestion_queue.put((message, hits, False, token))
+    finally:
+        if not queued:
+            source_progress.finish(chat_id, token)
+
+
+async def handle_raw_edit(update, account: str = PRIMARY_ACCOUNT):
+    """Правка сообщения: сопоставляется только измененный текст,
+    уведомление отправляется только по новым ключевым словам"""
+    try:
+        accepted = accept_update(update, account)
+        if accepted is None:
+            return
+        if not ingestion_queue.admit():
             return
+        try:
+            await accept_edited_message(update, account, *accepted)
+        finally:
+            ingestion_queue.release()
+
+    except Exception as e:
+        logger.error(f"Error in edit handler: {e}")
+
+
+async def accept_edited_message(update, account, message, chat_id, text):
+    pts, pts_count = update_pts(update)
+    if not seen_texts.update(chat_id, message.id, text):
+        source_progress.advance(chat_id, pts=pts)
+        return
 
-        keywords = data_manager.get_keywords()
-        if not keywords:
+    token = source_progress.begin(chat_id, None, pts, pts_count)
+    queued = False
+    try:
+        with ingestion_queue.timed("match"):
+            hits = await match_text(text)
+        if not hits:
             return
 
-        keyword = find_keyword_in_text(text, keywords)
-        if not keyword:
+        notified = notification_dedup.get_notified(chat_id, message.id)
+        hits = [hit for hit in hits if hit.keyword.lower() not in notified]
+        if not hits:
             return
 
-        logger.info(f"Keyword '{keyword}' found in message {message.id}")
+        message._finish_init(
+            client_pool.get(account),
+            getattr(update, "_entities", None) or {},
+            None
+        )
+        queued = await ingestion_queue.put((message, hits, True, token))
+    finally:
+        if not queued:
+            source_progress.finish(chat_id, token)
+
 
-        try:
-            client = get_client()
-            sender = await message.get_sender()
+async def process_queued(item):
+    message, hits, edited, token = item
+    try:
+        await process_message(message, hits, edited)
+    finally:
+        source_progress.finish(message.chat_id, token)
+
+
+def drop_queued(item):
+    """Вытесненное из очереди сообщение больше не удерживает позицию
+    источника"""
+    message, _, _, token = item
+    source_progress.finish(message.chat_id, token)
+
+
+async def process_message(
+    message,
+    hits: Optional[List[KeywordHit]] = None,
+    edited: bool = False
+):
+    """Обрабатывает сообщение источника. hits - уже найденные
+    совпадения, если сообщение прошло быстрый путь, edited - правка
+    ранее полученного сообщения"""
+    data = data_manager.get_data()
+    chat_id = message.chat_id
+    text = message.message
+
+    if not edited:
+        message_archive.add(chat_id, [message])
+
+    if hits is None:
+        with ingestion_queue.timed("match"):
+            hits = await match_text(text)
+    if not hits:
+        return
+
+    logger.info(
+        f"Keywords {[hit.keyword for hit in hits]} found "
+        f"in message {message.id}"
+    )
+
+    # Настройки могли измениться, пока сообщение ждало в очереди
+    settings_data = data["settings"]
+    if not settings_data["is_running"] or not settings_data["notifications"]:
+        return
+
+    source_data = data["sources"].get(str(chat_id))
+    if not source_data:
+        return
+
+    if notification_dedup.is_duplicate(
+        message,
+        [hit.keyword for hit in hits]
+    ):
+        logger.info(f"Duplicate notification for {message.id} suppressed")
+        return
+
+    try:
+        with ingestion_queue.timed("enrich"):
+            client = client_pool.client_for(chat_id)
+            sender = await entity_cache.get_sender(client, message)
             sender_id = message.sender_id
             sender_name = getattr(sender, "first_name", "Unknown")
             last_name = getattr(sender, "last_name", "")
@@ -61,8 +299,9 @@ async def handle_new_message(event):
                 sender_name += f" {last_name}"
             sender_username = getattr(sender, "username", None)
 
-            source_data = data["sources"][str(chat_id)]
-            message_link = await get_message_link(client, message)
+            message_link = await get_message_link(
+                client, message, source_data
+            )
 
             parent_channel = None
             if source_data["type"] == "discussion":
@@ -73,7 +312,7 @@ async def handle_new_message(event):
                         parent_channel = parent_data["title"]
 
             notification_text, keyboard = format_notification(
-                keyword=keyword,
+                hits=hits,
                 sender_id=sender_id,
                 sender_name=sender_name,
                 sender_username=sender_username,
@@ -82,28 +321,57 @@ async def handle_new_message(event):
                 source_username=source_data.get("username"),
                 message_text=text,
                 message_link=message_link,
-                parent_channel=parent_channel
+                parent_channel=parent_channel,
+                edited=edited
             )
 
-            for admin_id in data["settings"]["admins"]:
-                try:
-                    await bot.send_message(
-                        admin_id,
-                        notification_text,
-                        parse_mode="HTML",
-                        reply_markup=keyboard
-                    )
-                    logger.info(f"Notification sent to admin {admin_id}")
-                except Exception as e:
-                    logger.error(
-                        f"Error sending notification to {admin_id}: {e}"
-                    )
-
-        except Exception as e:
-            logger.error(f"Error processing message notification: {e}")
+        with ingestion_queue.timed("enqueue"):
+            await enqueue_notification(
+                data["settings"]["admins"],
+                notification_text,
+                keyboard
+            )
+        notification_dedup.record(message, [hit.keyword for hit in hits])
+        logger.info(f"Notification for message {message.id} queued")
 
     except Exception as e:
-        logger.error(f"Error in message handler: {e}")
+        notification_dedup.release(message)
+        logger.error(f"Error processing message notification: {e}")
+
+
+_registered: Dict[str, List[Tuple[object, Callable]]] = {}
+
+
+def register_account_handlers(account: str, account_client):
+    """Источники фильтруются по живому множеству, поэтому новые
+    источники не требуют перерегистрации обработчиков"""
+    for old_client, callback in _registered.pop(account, []):
+        old_client.remove_event_handler(callback)
+
+    async def on_new(update):
+        await handle_raw_update(update, account)
+
+    async def on_edit(update):
+        await handle_raw_edit(update, account)
+
+    account_client.add_event_handler(
+        on_new,
+        # Telethon не преобразует UpdateShortChatMessage для Raw,
+        # а обычные группы получают так большую часть сообщений
+        events.Raw(types=[
+            UpdateNewChannelMessage,
+            UpdateNewMessage,
+            UpdateShortChatMessage
+        ])
+    )
+    callbacks = [(account_client, on_new)]
+    if settings.MONITOR_EDITS:
+        account_client.add_event_handler(
+            on_edit,
+            events.Raw(types=[UpdateEditChannelMessage, UpdateEditMessage])
+        )
+        callbacks.append((account_client, on_edit))
+    _registered[account] = callbacks
 
 
 async def setup_monitor():
@@ -124,27 +392,22 @@ async def setup_monitor():
     is_authorized = await client.is_user_authorized()
     logger.info(f"Client authorized: {is_authorized}")
 
-    source_ids = data_manager.get_all_source_ids()
+    source_ids = data_manager.monitored_chat_ids
     logger.info(f"Registered sources for monitoring: {len(source_ids)}")
 
     if not source_ids:
-        logger.warning("No sources to monitor!")
-        return
-
-    if not data_manager.get_setting("is_running"):
+        logger.warning("No sources to monitor yet")
+    elif not data_manager.get_setting("is_running"):
         logger.info("Enabling parsing...")
         data_manager.update_setting("is_running", True)
 
-    try:
-        client.remove_event_handler(
-            handle_new_message,
-            events.NewMessage
-        )
-    except Exception:
-        pass
+    ingestion_queue.start(process_queued, drop_queued)
 
-    client.add_event_handler(
-        handle_new_message,
-        events.NewMessage(chats=source_ids)
-    )
+    # Все аккаунты пула передают сообщения в общую очередь обработки
+    for account in client_pool.accounts:
+        account_client = client_pool.get(account)
+        if account_client is None or not account_client.is_connected():
+            logger.warning(f"Account {account} not connected, skipped")
+            continue
+        register_account_handlers(account, account_client)
     logger.info("Message handler registered successfully")
\ No newline at end of file
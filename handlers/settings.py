@@ -1,10 +1,16 @@
+import asyncio
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
 from aiogram import types, F
 from aiogram.fsm.context import FSMContext
 from telethon import TelegramClient
 from core.bot import dp
-from core.client import get_client, set_client
-from core.database import data_manager
+from core.client import client_pool, get_client, set_client
+from core.database import data_manager, outbox
 from keyboards.inline import (
+    get_history_jobs_menu,
     get_settings_menu,
     get_admin_menu,
     get_back_button
@@ -12,6 +18,16 @@ from keyboards.inline import (
 from utils.states import AdminStates
 from filters.admin import AdminFilter
 from config import settings
+from services.archive import message_archive
+from services.dedup import notification_dedup
+from services.entity_cache import entity_cache
+from services.gap_recovery import gap_recovery
+from services.history_processor import rematch_archive
+from services.history_scheduler import history_scheduler
+from services.ingestion import ingestion_queue
+from services.match_pool import match_pool
+from services.pacing import get_pacer
+from services.notification import notification_sender
 from utils.logger import logger
 
 
@@ -43,14 +59,17 @@ async def toggle_notifications(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "export_data", AdminFilter())
 async def export_data(callback: types.CallbackQuery):
     try:
-        with open(settings.DATA_FILE, "r", encoding="utf-8") as f:
-            await callback.message.answer_document(
-                types.BufferedInputFile(
-                    f.read().encode(),
-                    filename="data_export.json"
-                ),
-                caption="📤 Экспорт данных",
-            )
+        await callback.message.answer_document(
+            types.BufferedInputFile(
+                json.dumps(
+                    data_manager.get_data(),
+                    ensure_ascii=False,
+                    indent=2
+                ).encode(),
+                filename="data_export.json"
+            ),
+            caption="📤 Экспорт данных",
+        )
     except Exception as e:
         await callback.answer(f"❌ Ошибка при экспорте: {str(e)}")
 
@@ -231,7 +250,16 @@ async def process_history_start(callback: types.CallbackQuery, state: FSMContext
     current_text = "📋 Выберите источники для обработки истории:\n\n"
     current_text += "Введите номера через пробел или запятую\n"
     current_text += "Например:1 3 5 или 1,3,5\n"
-    current_text += "Или введите все для обработки всех источников\n\n"
+    current_text += "Или введите все для обработки всех источников\n"
+    current_text += (
+        "Добавьте слово поиск, чтобы искать ключевые слова на сервере "
+        "Telegram вместо загрузки всей истории\n"
+        "Например: 1 3 поиск\n"
+        "Период можно ограничить: 7д - за последние 7 дней, "
+        "2026-01-01..2026-02-01 - между датами (UTC, включительно), "
+        "2026-01-01.. или ..2026-02-01 - с даты или до даты\n"
+        "Например: все 7д\n\n"
+    )
     
     for i, (source_id, source_data) in enumerate(sources_list, 1):
         source_type = source_data["type"]
@@ -277,6 +305,41 @@ async def process_history_start(callback: types.CallbackQuery, state: FSMContext
     await state.set_state(AdminStates.waiting_for_history_selection)
 
 
+PERIOD_DAYS = re.compile(r"^(\d+)(д|d)$")
+PERIOD_RANGE = re.compile(
+    r"^(\d{4}-\d{2}-\d{2})?\.\.(\d{4}-\d{2}-\d{2})?$"
+)
+
+
+def parse_period(
+    token: str
+) -> Optional[Tuple[Optional[datetime], Optional[datetime]]]:
+    """Разбирает период истории: "7д" или "2026-01-01..2026-02-01".
+    Возвращает (since, until) в UTC или None, если токен не период"""
+    match = PERIOD_DAYS.match(token)
+    if match:
+        since = datetime.now(timezone.utc) - timedelta(days=int(match[1]))
+        return since, None
+
+    match = PERIOD_RANGE.match(token)
+    if not match or not any(match.groups()):
+        return None
+
+    since = until = None
+    if match[1]:
+        since = datetime.strptime(match[1], "%Y-%m-%d").replace(
+            tzinfo=timezone.utc
+        )
+    if match[2]:
+        # Конечная дата входит в период целиком
+        until = datetime.strptime(match[2], "%Y-%m-%d").replace(
+            tzinfo=timezone.utc
+        ) + timedelta(days=1)
+    if since and until and since >= until:
+        raise ValueError(token)
+    return since, until
+
+
 @dp.message(AdminStates.waiting_for_history_selection, AdminFilter())
 async def process_history_selection(message: types.Message, state: FSMContext):
     """Обрабатывает выбор источников"""
@@ -290,16 +353,35 @@ async def process_history_selection(message: types.Message, state: FSMContext):
         return
     
     selected_indices = []
+
+    # Заменяем запятые на пробелы и разбиваем, отделяя параметры
+    tokens = user_input.replace(",", " ").split()
+    mode = "download"
+    if any(token in ["поиск", "search"] for token in tokens):
+        mode = "search"
+        tokens = [t for t in tokens if t not in ["поиск", "search"]]
+
+    since = until = None
+    rest = []
+    for token in tokens:
+        try:
+            period = parse_period(token)
+        except ValueError:
+            await message.answer(f"❌ Некорректный период: {token}")
+            return
+        if period is None:
+            rest.append(token)
+        else:
+            since, until = period
+    tokens = rest
     
     # Если пользователь ввел "все"
-    if user_input in ["все", "all", "всі"]:
+    if tokens and all(token in ["все", "all", "всі"] for token in tokens):
         selected_indices = list(range(len(sources_list)))
     else:
         # Парсим ввод (через пробел или запятую)
         try:
-            # Заменяем запятые на пробелы и разбиваем
-            numbers_str = user_input.replace(",", " ").split()
-            numbers = [int(num) for num in numbers_str]
+            numbers = [int(num) for num in tokens]
             
             # Проверяем валидность номеров
             for num in numbers:
@@ -332,43 +414,161 @@ async def process_history_selection(message: types.Message, state: FSMContext):
     # Сбрасываем флаг processed для выбранных источников
     for idx in selected_indices:
         source_id = sources_list[idx][0]
-        data_manager.get_data()["sources"][source_id]["processed"] = False
-    data_manager.save_data()
+        data_manager.mark_source_processed(source_id, False)
     
     await message.answer(
         f"⏳ Запускаю обработку истории для {len(selected_indices)} источников...\n"
         "Это может занять некоторое время."
     )
     
-    from services.history_processor import process_source_history
-    import asyncio
-    
-    # Запускаем обработку в фоне
+    # Ставим источники в очередь. Если у источника уже есть
+    # last_message_id и период не задан, загружаются только новые
+    # сообщения
+    skipped = 0
     for idx in selected_indices:
         source_id, source_data = sources_list[idx]
-        asyncio.create_task(
-            process_source_history(
-                client,
-                int(source_id),
-                message.from_user.id
-            )
+        incremental = (
+            mode == "download" and
+            since is None and until is None and
+            bool(data_manager.get_source_watermark(source_id))
+        )
+        job = history_scheduler.submit(
+            client,
+            source_id,
+            source_data["title"],
+            message.from_user.id,
+            incremental=incremental,
+            mode=mode,
+            since=since,
+            until=until
+        )
+        if job is None:
+            skipped += 1
+        else:
+            logger.info(f"Queued history processing for source {source_id} ({source_data['title']})")
+
+    if skipped:
+        await message.answer(
+            f"ℹ️ {skipped} источников уже в очереди или обрабатываются"
         )
-        logger.info(f"Started history processing for source {source_id} ({source_data['title']})")
     
     await state.clear()
     await message.answer(
-        "✅ Обработка истории запущена в фоне!\n"
+        "✅ Обработка истории поставлена в очередь!\n"
         "Вы получите уведомления по завершению каждого источника.",
         reply_markup=get_admin_menu()
     )
 
 
+@dp.callback_query(F.data == "rematch_archive", AdminFilter())
+async def start_rematch_archive(callback: types.CallbackQuery):
+    client = get_client()
+    if not client or not client.is_connected():
+        await callback.answer("❌ Клиент не подключен!", show_alert=True)
+        return
+
+    stats = message_archive.get_stats()
+    if not stats["messages"] and not stats["pending"]:
+        await callback.answer("❌ Архив пуст", show_alert=True)
+        return
+
+    asyncio.create_task(rematch_archive(client, callback.from_user.id))
+    await callback.answer()
+    await callback.message.edit_text(
+        f"⏳ Ищу ключевые слова в архиве "
+        f"({stats['messages'] + stats['pending']} сообщений, "
+        f"{stats['sources']} источников)...\n"
+        "Вы получите уведомление по завершению.",
+        reply_markup=get_back_button("settings")
+    )
+
+
+@dp.callback_query(F.data == "history_jobs", AdminFilter())
+async def show_history_jobs(callback: types.CallbackQuery):
+    jobs = history_scheduler.get_jobs()
+
+    if not jobs:
+        text = "📋 Задач обработки истории нет"
+    else:
+        status_emoji = {
+            "queued": "⏳",
+            "running": "▶️",
+            "finished": "✅",
+            "cancelled": "🚫",
+            "failed": "❌",
+        }
+        text = (
+            "📋 Задачи обработки истории "
+            f"(одновременно на аккаунт: {history_scheduler.concurrency}):\n"
+        )
+        for account in client_pool.accounts:
+            account_client = client_pool.get(account)
+            if not account_client:
+                continue
+            pacer_stats = get_pacer(account_client).get_stats()
+            text += (
+                f"⚡️ {account}: {pacer_stats['rate']:.2f} запр./с, "
+                f"FloodWait: {pacer_stats['flood_waits']} "
+                f"({pacer_stats['flood_wait_seconds']} с)\n"
+            )
+        text += "\n"
+        for job in jobs:
+            line = (
+                f"{status_emoji.get(job.status, '❓')} #{job.id} "
+                f"{job.title}"
+            )
+            if len(client_pool) > 1:
+                line += f" [{job.account}]"
+            if job.kwargs.get("mode") == "search":
+                line += " 🔎"
+            if job.kwargs.get("keywords"):
+                line += " 🔑"
+            if job.status != "queued":
+                line += (
+                    f"\n   └ {job.stats['processed']} сообщ. "
+                    f"(загружено {job.stats.get('transferred', 0)}), "
+                    f"{job.stats['matches']} совп., "
+                    f"{job.rate:.1f} сообщ./с"
+                )
+            line += "\n"
+            if len(text + line) > 4000:
+                break
+            text += line
+
+    try:
+        await callback.message.edit_text(
+            text,
+            reply_markup=get_history_jobs_menu(jobs)
+        )
+    except Exception:
+        await callback.answer()
+
+
+@dp.callback_query(F.data.startswith("cancel_history_job:"), AdminFilter())
+async def cancel_history_job(callback: types.CallbackQuery):
+    job_id = int(callback.data.split(":")[1])
+
+    if history_scheduler.cancel(job_id):
+        await callback.answer(f"🚫 Задача #{job_id} отменена")
+    else:
+        await callback.answer("⚠️ Задача уже завершена")
+
+    await show_history_jobs(callback)
+
+
 @dp.callback_query(F.data == "stats", AdminFilter())
 async def show_stats(callback: types.CallbackQuery):
     data = data_manager.get_data()
     sources = data["sources"]
     keywords = data["keywords"]
     settings_data = data["settings"]
+    cache_stats = entity_cache.get_stats()
+    queue_stats = ingestion_queue.get_stats()
+    sender_stats = notification_sender.get_stats()
+    outbox_size = await outbox.count()
+    archive_stats = message_archive.get_stats()
+    dedup_stats = notification_dedup.get_stats()
+    gap_stats = gap_recovery.get_stats()
 
     stats_text = (
         "📊 Статистика:\n\n"
@@ -379,8 +579,60 @@ async def show_stats(callback: types.CallbackQuery):
         f"├ Уведомления: "
         f"{'✅' if settings_data['notifications'] else '❌'}\n"
         f"└ Аккаунт: "
-        f"{'✅' if settings_data['use_account'] else '❌'}"
+        f"{'✅' if settings_data['use_account'] else '❌'}\n\n"
+        f"🗂 Кеш сущностей:\n"
+        f"├ Размер: {cache_stats['size']}\n"
+        f"├ Попадания: {cache_stats['hits']}\n"
+        f"└ Промахи: {cache_stats['misses']}\n\n"
+        f"📥 Очередь сообщений:\n"
+        f"├ Глубина: {queue_stats['depth']}/{queue_stats['max_size']}\n"
+        f"├ Обработчиков: {queue_stats['workers']}\n"
+        f"├ Апдейтов в работе: {queue_stats['in_flight']}\n"
+        f"├ Принято: {queue_stats['accepted']}\n"
+        f"└ Отброшено: {queue_stats['dropped']}\n\n"
+        f"📤 Отправка уведомлений:\n"
+        f"├ Отправлено: {sender_stats['sent']}\n"
+        f"├ Скорость: {sender_stats['rate']:.2f} сообщ./с\n"
+        f"├ Повторов: {sender_stats['retries']} "
+        f"(RetryAfter: {sender_stats['retry_after']})\n"
+        f"├ Ошибок: {sender_stats['failed']}\n"
+        f"├ В outbox: {outbox_size}\n"
+        f"└ Подавлено повторов: {dedup_stats['suppressed_messages']} "
+        f"(по тексту: {dedup_stats['suppressed_texts']})\n\n"
+        f"🗄 Архив сообщений:\n"
+        f"├ Источников: {archive_stats['sources']}\n"
+        f"├ Сообщений: {archive_stats['messages']}\n"
+        f"└ Ожидают записи: {archive_stats['pending']}\n\n"
+        f"🩹 Восстановление пропусков:\n"
+        f"├ Проверок: {gap_stats['runs']}\n"
+        f"├ Догружено сообщений: {gap_stats['recovered']}\n"
+        f"└ Слишком больших разрывов: {gap_stats['too_long']}"
     )
+    if match_pool.is_running:
+        pool_stats = match_pool.get_stats()
+        stats_text += (
+            f"\n\n⚙️ Процессы сопоставления: {pool_stats['workers']}, "
+            f"пачек {pool_stats['batches']}, "
+            f"в среднем {pool_stats['avg_batch']:.1f} сообщ., "
+            f"перезапусков {pool_stats['restarts']}, "
+            f"в цикле {pool_stats['fallbacks']}"
+        )
+    if len(client_pool) > 1:
+        stats_text += "\n\n👤 Аккаунты:"
+        for account_stats in client_pool.get_stats():
+            stats_text += (
+                f"\n• {account_stats['account']} "
+                f"{'✅' if account_stats['connected'] else '❌'}: "
+                f"{account_stats['sources']} ист., "
+                f"{account_stats['rate']:.2f} сообщ./с"
+            )
+    if queue_stats["stages"]:
+        stats_text += "\n\n⏱ Задержки по этапам:"
+        for stage, stage_stats in queue_stats["stages"].items():
+            stats_text += (
+                f"\n• {stage}: {stage_stats['avg'] * 1000:.0f} мс "
+                f"(макс. {stage_stats['max'] * 1000:.0f} мс)"
+            )
 
     await callback.message.edit_text(
         stats_text,
@@ -3,7 +3,7 @@ import re
 from aiogram import types, F
 from aiogram.fsm.context import FSMContext
 from core.bot import dp
-from core.client import get_client
+from core.client import client_pool
 from core.database import data_manager
 from keyboards.inline import (
     get_sources_menu,
@@ -12,7 +12,7 @@ from keyboards.inline import (
 )
 from utils.states import AdminStates
 from filters.admin import AdminFilter
-from services.history_processor import process_source_history
+from services.history_scheduler import history_scheduler
 from utils.logger import logger
 from telethon.tl.functions.channels import JoinChannelRequest, GetFullChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest
@@ -163,7 +163,10 @@ async def process_add_source(
     state: FSMContext
 ):
     source_input = message.text.strip()
-    client = get_client()
+    # Источник закрепляется за наименее загруженным аккаунтом пула,
+    # он же вступает в чат и обрабатывает историю
+    account = client_pool.pick_account()
+    client = client_pool.get(account)
 
     if not client or not client.is_connected():
         await message.answer(
@@ -253,6 +256,7 @@ async def process_add_source(
                     entity_username,
                     discussion_chat_id=discussion_chat_id
                 )
+                client_pool.assign(entity_id, account)
 
                 try:
                     discussion_entity = await client.get_entity(discussion_chat_id)
@@ -272,6 +276,7 @@ async def process_add_source(
                         None,
                         parent_channel=entity_id
                     )
+                    client_pool.assign(discussion_chat_id, account)
 
                     await message.answer(
                         f"✅ Канал {entity_title} добавлен!\n"
@@ -283,12 +288,11 @@ async def process_add_source(
                         "⏳ Обрабатываю историю комментариев..."
                     )
 
-                    asyncio.create_task(
-                        process_source_history(
-                            client,
-                            discussion_chat_id,
-                            message.from_user.id
-                        )
+                    history_scheduler.submit(
+                        client,
+                        discussion_chat_id,
+                        discussion_title,
+                        message.from_user.id
                     )
                     
                 except Exception as e:
@@ -304,6 +308,7 @@ async def process_add_source(
                     entity_title,
                     entity_username
                 )
+                client_pool.assign(entity_id, account)
                 
                 await message.answer(
                     f"✅ Канал {entity_title} добавлен!\n"
@@ -326,6 +331,7 @@ async def process_add_source(
                 entity_title,
                 entity_username
             )
+            client_pool.assign(entity_id, account)
 
             await message.answer(
                 f"✅ Группа {entity_title} добавлена!\n"
@@ -334,12 +340,11 @@ async def process_add_source(
                 "⏳ Обрабатываю историю сообщений..."
             )
 
-            asyncio.create_task(
-                process_source_history(
-                    client,
-                    entity_id,
-                    message.from_user.id
-                )
+            history_scheduler.submit(
+                client,
+                entity_id,
+                entity_title,
+                message.from_user.id
             )
 
     except UsernameNotOccupiedError:
@@ -131,6 +131,18 @@ def get_settings_menu() -> InlineKeyboardMarkup:
                     callback_data="process_history"
                 ),
             ],
+            [
+                InlineKeyboardButton(
+                    text="📋 Задачи истории",
+                    callback_data="history_jobs"
+                ),
+            ],
+            [
+                InlineKeyboardButton(
+                    text="🗄 Поиск по архиву",
+                    callback_data="rematch_archive"
+                ),
+            ],
             [
                 InlineKeyboardButton(
                     text="📤 Экспорт данных",
@@ -148,6 +160,33 @@ def get_settings_menu() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_history_jobs_menu(jobs) -> InlineKeyboardMarkup:
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=f"🚫 Отменить #{job.id}",
+                callback_data=f"cancel_history_job:{job.id}"
+            )
+        ]
+        for job in jobs
+        if job.status in ("queued", "running")
+    ][:10]
+
+    buttons.append([
+        InlineKeyboardButton(
+            text="🔄 Обновить",
+            callback_data="history_jobs"
+        )
+    ])
+    buttons.append([
+        InlineKeyboardButton(
+            text="🔙 Назад",
+            callback_data="settings"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 def get_back_button(
     callback_data: str = "back_to_main"
 ) -> InlineKeyboardMarkup:
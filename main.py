@@ -1,7 +1,12 @@
 import asyncio
 from core.bot import bot, dp
-from core.client import init_client, get_client
+from core.client import client_pool, init_client, init_pool, get_client
 from core.database import data_manager
+from services.archive import message_archive
+from services.dedup import notification_dedup
+from services.ingestion import ingestion_queue
+from services.match_pool import match_pool
+from services.notification import run_outbox_delivery
 from utils.logger import logger
 
 from handlers import admin, sources, keywords, settings
@@ -13,6 +18,13 @@ async def on_startup():
     data_manager.get_data()
     logger.info("Data loaded successfully")
 
+    asyncio.create_task(data_manager.run_write_behind())
+    asyncio.create_task(data_manager.run_source_state_persist())
+    asyncio.create_task(run_outbox_delivery())
+    asyncio.create_task(message_archive.run_flush())
+    asyncio.create_task(notification_dedup.run_persist())
+    match_pool.start()
+
     client = await init_client()
     if client:
         logger.info("Telethon client initialized")
@@ -26,7 +38,17 @@ async def on_startup():
                 logger.info("User authorized in Telethon")
 
                 from handlers.monitor import setup_monitor
+                from services.history_scheduler import (
+                    catch_up_sources,
+                    resume_history_scans
+                )
+                from services.gap_recovery import gap_recovery
+                await init_pool()
                 await setup_monitor()
+                resume_history_scans(client)
+                catch_up_sources(client)
+                for account in client_pool.accounts:
+                    asyncio.create_task(gap_recovery.run(account))
             else:
                 logger.warning("User not authorized in Telethon")
         else:
@@ -44,11 +66,19 @@ async def on_startup():
 
 
 async def run_telethon():
-    """Запускает telethon client в фоне"""
-    client = get_client()
-    if client and client.is_connected():
-        logger.info("Starting Telethon client loop...")
-        await client.run_until_disconnected()
+    """Запускает telethon clients пула в фоне"""
+    clients = [
+        client_pool.get(account) for account in client_pool.accounts
+    ]
+    clients = [
+        client for client in clients
+        if client and client.is_connected()
+    ]
+    if clients:
+        logger.info(f"Starting Telethon client loop ({len(clients)})...")
+        await asyncio.gather(
+            *(client.run_until_disconnected() for client in clients)
+        )
     else:
         logger.warning("Telethon client not available for running")
 
@@ -73,11 +103,27 @@ async def main():
     except Exception as e:
         logger.error(f"Bot startup error: {e}")
     finally:
+        await ingestion_queue.stop()
+        match_pool.stop()
+
+        try:
+            await data_manager.flush_source_state()
+        except Exception as e:
+            logger.error(f"Error flushing data on shutdown: {e}")
+
+        await message_archive.flush()
+
+        try:
+            await notification_dedup.save()
+        except Exception as e:
+            logger.error(f"Error saving dedup state on shutdown: {e}")
+
         # Закрываем соединения при остановке
-        client = get_client()
-        if client and client.is_connected():
-            await client.disconnect()
-            logger.info("Telethon client disconnected")
+        for account in client_pool.accounts:
+            client = client_pool.get(account)
+            if client and client.is_connected():
+                await client.disconnect()
+                logger.info(f"Telethon client {account} disconnected")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple
+)
+from config import settings
+from utils.logger import logger
+
+
+BLOCK_HEADER = struct.Struct(">I")
+INDEX_FILE = "index.jsonl"
+
+
+class ArchivedMessage(NamedTuple):
+    """Сообщение из архива. Поля совпадают с атрибутами сообщения
+    Telethon, которые используются при формировании уведомлений"""
+    id: int
+    chat_id: int
+    date: datetime
+    sender_id: Optional[int]
+    message: str
+
+
+class ArchiveBlock(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+    count: int
+    min_id: int
+    max_id: int
+    min_date: float
+    max_date: float
+
+
+class MessageArchive:
+    """Локальный архив сообщений источников.
+
+    Для каждого источника сообщения дописываются в сегменты
+    <root>/<source_id>/<номер>.seg блоками, сжатыми zlib. Каждый блок
+    описывается строкой в index.jsonl (диапазоны id и дат), поэтому
+    чтение по id или периоду распаковывает только нужные блоки.
+    Один источник может содержать сообщение несколько раз (история и
+    живые события), повторы отбрасываются при чтении."""
+
+    def __init__(
+        self,
+        root: str,
+        block_size: int,
+        segment_bytes: int,
+        enabled: bool = True
+    ):
+        self.root = root
+        self.block_size = block_size
+        self.segment_bytes = segment_bytes
+        self.enabled = enabled
+        self._pending: Dict[int, List[list]] = {}
+        self._index: Dict[int, List[ArchiveBlock]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._dirty: Optional[asyncio.Event] = None
+
+    def add(self, source_id: int, messages: Iterable):
+        """Буферизует сообщения Telethon для записи в архив"""
+        if not self.enabled:
+            return
+
+        records = [
+            [
+                message.id,
+                message.date.timestamp(),
+                message.sender_id,
+                message.message,
+            ]
+            for message in messages
+            if getattr(message, "message", None)
+        ]
+        if not records:
+            return
+
+        pending = self._pending.setdefault(int(source_id), [])
+        pending.extend(records)
+        if len(pending) >= self.block_size:
+            self._get_dirty().set()
+
+    def _get_dirty(self) -> asyncio.Event:
+        if self._dirty is None:
+            self._dirty = asyncio.Event()
+        return self._dirty
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            pending = self._pending
+            self._pending = {}
+            for source_id, records in pending.items():
+                try:
+                    await self._run(self._write, source_id, records)
+                except Exception as e:
+                    logger.error(
+                        f"Error writing archive for source {source_id}: {e}"
+                    )
+
+    async def run_flush(self):
+        """Периодически сбрасывает буфер, сразу - при заполнении блока"""
+        if not self.enabled:
+            return
+
+        dirty = self._get_dirty()
+        while True:
+            try:
+                await asyncio.wait_for(
+                    dirty.wait(),
+                    settings.ARCHIVE_FLUSH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            dirty.clear()
+            await self.flush()
+
+    def _source_dir(self, source_id: int) -> str:
+        return os.path.join(self.root, str(source_id))
+
+    def _segment_path(self, source_id: int, segment: int) -> str:
+        return os.path.join(self._source_dir(source_id), f"{segment:06d}.seg")
+
+    def _load_index(self, source_id: int) -> List[ArchiveBlock]:
+        blocks = self._index.get(source_id)
+        if blocks is not None:
+            return blocks
+
+        blocks = []
+        path = os.path.join(self._source_dir(source_id), INDEX_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        blocks.append(ArchiveBlock(*json.loads(line)))
+                    except (ValueError, TypeError):
+                        # Недописанная строка после аварийной остановки
+                        logger.warning(
+                            f"Skipping broken archive index line in {path}"
+                        )
+        self._index[source_id] = blocks
+        return blocks
+
+    def _write(self, source_id: int, records: List[list]):
+        os.makedirs(self._source_dir(source_id), exist_ok=True)
+        blocks = self._load_index(source_id)
+
+        for start in range(0, len(records), self.block_size):
+            chunk = records[start:start + self.block_size]
+            data = zlib.compress(
+                json.dumps(chunk, ensure_ascii=False).encode("utf-8")
+            )
+
+            segment = blocks[-1].segment if blocks else 0
+            path = self._segment_path(source_id, segment)
+            if (
+                os.path.exists(path) and
+                os.path.getsize(path) >= self.segment_bytes
+            ):
+                segment += 1
+                path = self._segment_path(source_id, segment)
+
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(BLOCK_HEADER.pack(len(data)))
+                f.write(data)
+
+            ids = [record[0] for record in chunk]
+            dates = [record[1] for record in chunk]
+            block = ArchiveBlock(
+                segment,
+                offset,
+                BLOCK_HEADER.size + len(data),
+                len(chunk),
+                min(ids),
+                max(ids),
+                min(dates),
+                max(dates)
+            )
+            # Индекс пишется после данных: блок без строки индекса
+            # просто не будет прочитан
+            index_path = os.path.join(
+                self._source_dir(source_id),
+                INDEX_FILE
+            )
+            with open(index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(list(block)) + "\n")
+            blocks.append(block)
+
+    def _read_block(self, source_id: int, block: ArchiveBlock) -> List[list]:
+        with open(self._segment_path(source_id, block.segment), "rb") as f:
+            f.seek(block.offset)
+            raw = f.read(block.length)
+        (length,) = BLOCK_HEADER.unpack_from(raw)
+        data = raw[BLOCK_HEADER.size:BLOCK_HEADER.size + length]
+        return json.loads(zlib.decompress(data))
+
+    def iter_messages(
+        self,
+        source_id: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> Iterator[ArchivedMessage]:
+        """Читает сообщения источника (синхронно, для executor)"""
+        source_id = int(source_id)
+        since_ts = since.timestamp() if since else None
+        until_ts = until.timestamp() if until else None
+        seen = set()
+
+        for block in list(self._load_index(source_id)):
+            if since_ts is not None and block.max_date < since_ts:
+                continue
+            if until_ts is not None and block.min_date >= until_ts:
+                continue
+
+            try:
+                records = self._read_block(source_id, block)
+            except (OSError, ValueError, zlib.error) as e:
+                logger.warning(
+                    f"Skipping broken archive block of source {source_id}: {e}"
+                )
+                continue
+
+            for message_id, date, sender_id, text in records:
+                if message_id in seen:
+                    continue
+                if since_ts is not None and date < since_ts:
+                    continue
+                if until_ts is not None and date >= until_ts:
+                    continue
+                seen.add(message_id)
+                yield ArchivedMessage(
+                    message_id,
+                    source_id,
+                    datetime.fromtimestamp(date, tz=timezone.utc),
+                    sender_id,
+                    text
+                )
+
+    def _get_message(
+        self,
+        source_id: int,
+        message_id: int
+    ) -> Optional[ArchivedMessage]:
+        source_id = int(source_id)
+        for block in reversed(self._load_index(source_id)):
+            if not block.min_id <= message_id <= block.max_id:
+                continue
+            for record in self._read_block(source_id, block):
+                if record[0] == message_id:
+                    return ArchivedMessage(
+                        record[0],
+                        source_id,
+                        datetime.fromtimestamp(record[1], tz=timezone.utc),
+                        record[2],
+                        record[3]
+                    )
+        return None
+
+    async def get_message(
+        self,
+        source_id: int,
+        message_id: int
+    ) -> Optional[ArchivedMessage]:
+        return await self._run(self._get_message, source_id, message_id)
+
+    @staticmethod
+    def _take(
+        messages: Iterator[ArchivedMessage],
+        size: int
+    ) -> List[ArchivedMessage]:
+        return list(islice(messages, size))
+
+    async def match(
+        self,
+        source_id: int,
+        match: Callable[[List[str]], Awaitable[List[list]]],
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> Tuple[int, List[Tuple[ArchivedMessage, list]]]:
+        """Сопоставляет архив источника без обращения к сети.
+        Сообщения читаются в executor пачками по block_size, тексты пачки
+        сопоставляет match (services.match_pool.match_texts).
+        Возвращает число просмотренных сообщений и найденные совпадения"""
+        await self.flush()
+        messages = self.iter_messages(source_id, since, until)
+        scanned = 0
+        found = []
+        while True:
+            batch = await self._run(self._take, messages, self.block_size)
+            if not batch:
+                return scanned, found
+            scanned += len(batch)
+            results = await match([message.message for message in batch])
+            for message, hits in zip(batch, results):
+                if hits:
+                    found.append((message, hits))
+
+    def has_source(self, source_id: int) -> bool:
+        return bool(self._load_index(int(source_id)))
+
+    def get_stats(self) -> Dict[str, int]:
+        sources = blocks = messages = 0
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                try:
+                    source_blocks = self._load_index(int(name))
+                except ValueError:
+                    continue
+                if source_blocks:
+                    sources += 1
+                    blocks += len(source_blocks)
+                    messages += sum(block.count for block in source_blocks)
+        return {
+            "sources": sources,
+            "blocks": blocks,
+            "messages": messages,
+            "pending": sum(len(records) for records in self._pending.values()),
+        }
+
+
+message_archive = MessageArchive(
+    settings.ARCHIVE_DIR,
+    settings.ARCHIVE_BLOCK_SIZE,
+    settings.ARCHIVE_SEGMENT_BYTES,
+    settings.ARCHIVE_ENABLED
+)
@@ -0,0 +1,155 @@
+import asyncio
+from typing import Dict, List, Optional, Set
+from config import settings
+from core.client import get_client
+from core.database import data_manager
+from services.archive import message_archive
+from services.history_processor import rematch_archive
+from services.history_scheduler import PRIORITY_BACKGROUND, history_scheduler
+from utils.logger import logger
+
+
+class KeywordBackfill:
+    """Поиск прошлых совпадений для только что добавленных слов.
+
+    Слова, добавленные в течение BACKFILL_DELAY, объединяются в одну
+    задачу на каждого добавившего их администратора, ему же приходят
+    результаты. Ищутся только новые слова, поэтому сообщения не
+    приходят повторно по словам, которые уже отслеживались. Источники,
+    история которых полностью загружена в архив, проверяются локально,
+    остальные - серверным поиском в пределах HISTORY_MESSAGES_LIMIT,
+    после текущего сканирования источника, если оно уже идет."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._keywords: Dict[Optional[int], List[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._waiting: Set[asyncio.Task] = set()
+
+    def schedule(self, keyword: str, admin_id: Optional[int]):
+        scheduled = {
+            k.lower() for keywords in self._keywords.values() for k in keywords
+        }
+        if keyword.lower() not in scheduled:
+            self._keywords.setdefault(admin_id, []).append(keyword)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Слова, добавленные во время поиска, обрабатываются следующим
+        # проходом той же задачи
+        while self._keywords:
+            await asyncio.sleep(self.delay)
+
+            pending = self._keywords
+            self._keywords = {}
+
+            client = get_client()
+            if not client or not client.is_connected():
+                logger.warning(
+                    "Keyword backfill skipped: client not connected"
+                )
+                continue
+
+            # Слова, удаленные за время ожидания, не ищутся
+            active = {k.lower() for k in data_manager.get_keywords()}
+            for admin_id, keywords in pending.items():
+                keywords = [k for k in keywords if k.lower() in active]
+                if keywords:
+                    await self._backfill(client, admin_id, keywords)
+
+    async def _backfill(
+        self,
+        client,
+        admin_id: Optional[int],
+        keywords: List[str]
+    ):
+        sources = data_manager.get_data()["sources"]
+        archived = []
+        for source_id in data_manager.get_all_source_ids():
+            # Архив, начатый после первого сканирования, содержит только
+            # новые сообщения и не заменяет поиск
+            if (
+                message_archive.enabled and
+                data_manager.is_source_archived(source_id) and
+                message_archive.has_source(source_id)
+            ):
+                archived.append(source_id)
+                continue
+
+            task = asyncio.create_task(
+                self._submit(
+                    client,
+                    source_id,
+                    sources[str(source_id)]["title"],
+                    admin_id,
+                    keywords
+                )
+            )
+            self._waiting.add(task)
+            task.add_done_callback(self._waiting.discard)
+
+        logger.info(
+            f"Keyword backfill for {keywords}: {len(archived)} sources "
+            f"from archive"
+        )
+        if archived:
+            await rematch_archive(
+                client,
+                admin_id,
+                keywords,
+                archived
+            )
+
+    async def _submit(
+        self,
+        client,
+        source_id: int,
+        title: str,
+        admin_id: Optional[int],
+        keywords: List[str]
+    ):
+        """Ставит поиск слов в очередь, когда источник освободится"""
+        resumed = False
+        while True:
+            job = history_scheduler.get_active(source_id)
+            if job is None and data_manager.get_history_checkpoint(source_id):
+                if resumed:
+                    logger.warning(
+                        f"Keyword backfill for {source_id} skipped: "
+                        "interrupted scan could not be completed"
+                    )
+                    return
+                # Сначала завершается прерванное сканирование, иначе
+                # поиск с другими параметрами отбросит его позицию
+                job = history_scheduler.submit(
+                    client,
+                    source_id,
+                    title,
+                    None,
+                    priority=PRIORITY_BACKGROUND,
+                    resume=True
+                )
+                resumed = True
+
+            if job is not None:
+                logger.info(
+                    f"Keyword backfill for {source_id} waits for "
+                    f"history job #{job.id}"
+                )
+                await job.wait()
+                continue
+
+            history_scheduler.submit(
+                client,
+                source_id,
+                title,
+                admin_id,
+                priority=PRIORITY_BACKGROUND,
+                mode="search",
+                keywords=keywords
+            )
+            return
+
+
+keyword_backfill = KeywordBackfill(settings.BACKFILL_DELAY)
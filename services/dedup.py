@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+from config import settings
+from core.storage import write_file_atomic
+from utils.logger import logger
+
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def text_hash(text: str) -> str:
+    """Хеш текста без учета регистра и пробелов"""
+    normalized = WHITESPACE.sub(" ", text).strip().lower()
+    return hashlib.blake2b(
+        normalized.encode("utf-8"),
+        digest_size=8
+    ).hexdigest()
+
+
+class NotificationDedup:
+    """Отсечение повторных уведомлений.
+
+    Сообщение (chat_id, message_id) не уведомляется повторно по тем же
+    ключевым словам, например при живом событии и последующем
+    сканировании истории. Если text_window больше нуля, одинаковый
+    текст (пересылки, спам) отсекается, когда даты сообщений отстоят
+    меньше чем на text_window секунд. В одном источнике повтором
+    текста считается только сообщение того же отправителя.
+    Оба набора ограничены max_entries (LRU) и сохраняются на диск.
+    Уведомление запоминается только после записи в outbox (record),
+    поэтому сбой до нее не мешает повторной отправке."""
+
+    def __init__(self, path: str, max_entries: int, text_window: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.text_window = text_window
+        self._messages: "OrderedDict[str, list]" = OrderedDict()
+        self._texts: "OrderedDict[str, list]" = OrderedDict()
+        self._inflight: Dict[str, set] = {}
+        self._inflight_texts: Dict[str, list] = {}
+        self._dirty: Optional[asyncio.Event] = None
+        self._loaded = False
+
+        self.suppressed_messages = 0
+        self.suppressed_texts = 0
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading dedup state: {e}")
+            return
+
+        for key, seen_at, keywords in data.get("messages", []):
+            self._messages[key] = [seen_at, keywords]
+        for key, *entry in data.get("texts", []):
+            # Записи старого формата без источника и отправителя
+            if len(entry) == 4:
+                self._texts[key] = entry
+        logger.info(
+            f"Dedup state loaded: {len(self._messages)} messages, "
+            f"{len(self._texts)} texts"
+        )
+
+    def _remember(
+        self,
+        entries: "OrderedDict[str, list]",
+        key: str,
+        entry: list
+    ):
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def _keys(self, message) -> Tuple[str, Optional[str]]:
+        text = getattr(message, "message", None)
+        content_key = None
+        if text and self.text_window > 0:
+            content_key = text_hash(text)
+        return f"{message.chat_id}:{message.id}", content_key
+
+    @staticmethod
+    def _text_entry(message, keywords: Iterable[str]) -> list:
+        """Запись текста: дата сообщения, слова, источник, отправитель"""
+        date = getattr(message, "date", None)
+        return [
+            date.timestamp() if date else time.time(),
+            sorted(keywords),
+            message.chat_id,
+            message.sender_id,
+        ]
+
+    def _same_text(self, entry: Optional[list], new_entry: list) -> bool:
+        """Относится ли запись к тому же тексту, что и new_entry"""
+        if entry is None:
+            return False
+        if abs(new_entry[0] - entry[0]) >= self.text_window:
+            return False
+        # В одном источнике одинаковый текст разных отправителей -
+        # разные сообщения
+        return entry[2] != new_entry[2] or entry[3] == new_entry[3]
+
+    def is_duplicate(self, message, keywords: Iterable[str]) -> bool:
+        """Проверяет, отправлялось ли уже такое уведомление.
+
+        Повтором считается только уведомление без новых слов: если
+        после добавления слова сообщение совпало с ним, оно проходит.
+        Новое уведомление резервируется до record или release, чтобы
+        параллельная обработка того же сообщения не отправила его дважды"""
+        if not self._loaded:
+            self._load()
+
+        keywords = {keyword.lower() for keyword in keywords}
+        message_key, content_key = self._keys(message)
+
+        entry = self._messages.get(message_key)
+        if (
+            (entry is not None and keywords <= set(entry[1])) or
+            keywords <= self._inflight.get(message_key, set())
+        ):
+            self.suppressed_messages += 1
+            return True
+
+        if content_key is not None:
+            text_entry = self._text_entry(message, keywords)
+            for entry in (
+                self._texts.get(content_key),
+                self._inflight_texts.get(content_key),
+            ):
+                if (
+                    self._same_text(entry, text_entry) and
+                    keywords <= set(entry[1])
+                ):
+                    self.suppressed_texts += 1
+                    return True
+            self._inflight_texts[content_key] = text_entry + [message_key]
+
+        self._inflight.setdefault(message_key, set()).update(keywords)
+        return False
+
+    def record(self, message, keywords: Iterable[str]):
+        """Запоминает уведомление после его записи в outbox"""
+        if not self._loaded:
+            self._load()
+
+        self.release(message)
+        keywords = {keyword.lower() for keyword in keywords}
+        message_key, content_key = self._keys(message)
+
+        entry = self._messages.get(message_key)
+        self._remember(
+            self._messages,
+            message_key,
+            [time.time(), sorted(keywords | set(entry[1] if entry else ()))]
+        )
+
+        if content_key is not None:
+            text_entry = self._text_entry(message, keywords)
+            entry = self._texts.get(content_key)
+            if self._same_text(entry, text_entry):
+                text_entry[1] = sorted(keywords | set(entry[1]))
+            self._remember(self._texts, content_key, text_entry)
+        self._mark_dirty()
+
+    def release(self, message):
+        """Снимает резерв, если уведомление не удалось поставить в
+        очередь, - оно будет отправлено при следующей обработке"""
+        message_key, content_key = self._keys(message)
+        self._inflight.pop(message_key, None)
+        entry = self._inflight_texts.get(content_key)
+        if entry is not None and entry[-1] == message_key:
+            del self._inflight_texts[content_key]
+
+    def _mark_dirty(self):
+        if self._dirty is None:
+            self._dirty = asyncio.Event()
+        self._dirty.set()
+
+    def _snapshot(self) -> str:
+        return json.dumps({
+            "messages": [
+                [key, seen_at, keywords]
+                for key, (seen_at, keywords) in self._messages.items()
+            ],
+            "texts": [
+                [key, *entry] for key, entry in self._texts.items()
+            ],
+        }, ensure_ascii=False)
+
+    async def save(self):
+        if not self._loaded:
+            return
+        payload = self._snapshot()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            write_file_atomic,
+            self.path,
+            payload
+        )
+
+    async def run_persist(self):
+        if self._dirty is None:
+            self._dirty = asyncio.Event()
+
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(settings.DEDUP_SAVE_INTERVAL)
+            self._dirty.clear()
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Error saving dedup state: {e}")
+                self._dirty.set()
+
+    def get_notified(self, chat_id: int, message_id: int) -> Set[str]:
+        """Ключевые слова, по которым сообщение уже уведомлялось"""
+        if not self._loaded:
+            self._load()
+        entry = self._messages.get(f"{chat_id}:{message_id}")
+        return set(entry[1]) if entry else set()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "messages": len(self._messages),
+            "texts": len(self._texts),
+            "suppressed_messages": self.suppressed_messages,
+            "suppressed_texts": self.suppressed_texts,
+        }
+
+
+notification_dedup = NotificationDedup(
+    settings.DEDUP_FILE,
+    settings.DEDUP_MAX_ENTRIES,
+    settings.DEDUP_TEXT_WINDOW
+)
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from config import settings
+from utils.logger import logger
+
+
+class EntityCache:
+    """LRU кеш сущностей Telegram (чаты и пользователи) с TTL"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, entity_id: int):
+        entry = self._entries.get(entity_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        entity, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[entity_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(entity_id)
+        self.hits += 1
+        return entity
+
+    def put(self, entity_id: int, entity):
+        if entity is None or entity_id is None:
+            return
+
+        self._entries[entity_id] = (entity, time.monotonic() + self.ttl)
+        self._entries.move_to_end(entity_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_entity(self, client, entity_id: int):
+        entity = self.get(entity_id)
+        if entity is not None:
+            return entity
+
+        entity = await client.get_entity(entity_id)
+        self.put(entity_id, entity)
+        return entity
+
+    async def get_sender(self, client, message):
+        sender_id = message.sender_id
+        if sender_id is None:
+            return None
+
+        # Telethon часто уже содержит отправителя из самого апдейта
+        sender = getattr(message, "sender", None)
+        if sender is not None:
+            self.put(sender_id, sender)
+            return sender
+
+        try:
+            return await self.get_entity(client, sender_id)
+        except Exception as e:
+            logger.warning(f"Error resolving sender {sender_id}: {e}")
+            return None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+entity_cache = EntityCache(
+    settings.ENTITY_CACHE_SIZE,
+    settings.ENTITY_CACHE_TTL
+)
+
+
+async def get_message_link(
+    client,
+    message,
+    source_data: Optional[Dict] = None
+) -> Optional[str]:
+    try:
+        username = None
+        if source_data is not None and source_data.get("username"):
+            username = source_data["username"]
+        else:
+            chat = await entity_cache.get_entity(client, message.chat_id)
+            username = getattr(chat, "username", None)
+
+        if username:
+            return f"https://t.me/{username}/{message.id}"
+        else:
+            chat_id_str = str(message.chat_id).replace("-100", "")
+            return f"https://t.me/c/{chat_id_str}/{message.id}"
+    except Exception:
+        return None
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from typing import Dict
+from telethon import TelegramClient, utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.updates import GetChannelDifferenceRequest
+from telethon.tl.types import (
+    ChannelMessagesFilterEmpty,
+    PeerChannel,
+    updates
+)
+from config import settings
+from core.client import client_pool
+from core.database import data_manager
+from services.history_processor import index_batch_entities
+from services.history_scheduler import PRIORITY_BACKGROUND, history_scheduler
+from services.ingestion import ingestion_queue
+from services.pacing import get_pacer
+from services.source_progress import source_progress
+from utils.logger import logger
+
+
+class GapRecovery:
+    """Догрузка сообщений каналов, пропущенных в потоке обновлений.
+
+    Для каждого канала-источника хранится pts, с которого
+    updates.getChannelDifference возвращает все новые сообщения.
+    pts продвигается и живыми апдейтами (handlers.monitor), поэтому
+    запрос возвращает только сообщения, пропущенные при отключении или
+    перезапуске. Они передаются в общую очередь обработки."""
+
+    def __init__(self):
+        self.runs = 0
+        self.recovered = 0
+        self.too_long = 0
+        self.last_run_at = 0.0
+
+    async def _init_pts(
+        self,
+        client: TelegramClient,
+        source_id: int,
+        channel
+    ):
+        full = await client(GetFullChannelRequest(channel))
+        data_manager.update_source_pts(source_id, full.full_chat.pts)
+        logger.info(
+            f"Gap recovery: pts {full.full_chat.pts} stored for {source_id}"
+        )
+
+    async def _feed(self, source_id: int, difference, pts: int) -> int:
+        """Передает сообщения в очередь обработки. Каждое удерживает
+        pts источника на значении запроса, пока не будет обработано"""
+        index_batch_entities(difference)
+        if isinstance(difference, updates.ChannelDifferenceTooLong):
+            messages = difference.messages
+        else:
+            messages = difference.new_messages
+
+        count = 0
+        for message in messages:
+            if not getattr(message, "message", None):
+                continue
+            token = source_progress.begin(source_id, message.id, pts)
+            queued = False
+            try:
+                queued = await ingestion_queue.put(
+                    (message, None, False, token)
+                )
+            finally:
+                if not queued:
+                    source_progress.finish(source_id, token)
+            count += 1
+        return count
+
+    async def recover_source(self, client: TelegramClient, source_id: int):
+        _, peer_type = utils.resolve_id(source_id)
+        if peer_type is not PeerChannel:
+            # Обычные группы используют общий pts аккаунта
+            return
+
+        channel = utils.get_input_channel(
+            await client.get_input_entity(source_id)
+        )
+        pts = data_manager.get_source_pts(source_id)
+        if pts is None:
+            await self._init_pts(client, source_id, channel)
+            return
+
+        pacer = get_pacer(client)
+        while True:
+            await pacer.wait()
+            difference = await client(
+                GetChannelDifferenceRequest(
+                    channel=channel,
+                    filter=ChannelMessagesFilterEmpty(),
+                    pts=pts,
+                    limit=settings.GAP_DIFFERENCE_LIMIT,
+                    force=False
+                ),
+                flood_sleep_threshold=0
+            )
+            pacer.on_success()
+
+            if isinstance(difference, updates.ChannelDifferenceEmpty):
+                source_progress.advance(source_id, pts=difference.pts)
+                return
+
+            self.recovered += await self._feed(source_id, difference, pts)
+
+            if isinstance(difference, updates.ChannelDifferenceTooLong):
+                # Разрыв слишком большой для getChannelDifference:
+                # остаток догружается обычным инкрементальным
+                # сканированием истории
+                self.too_long += 1
+                source_progress.advance(source_id, pts=difference.dialog.pts)
+                source = data_manager.get_data()["sources"][str(source_id)]
+                history_scheduler.submit(
+                    client,
+                    source_id,
+                    source["title"],
+                    None,
+                    priority=PRIORITY_BACKGROUND,
+                    incremental=True,
+                    # Прерванное сканирование не отбрасывается
+                    resume=bool(
+                        data_manager.get_history_checkpoint(source_id)
+                    )
+                )
+                return
+
+            pts = difference.pts
+            source_progress.advance(source_id, pts=pts)
+            if difference.final:
+                return
+
+    async def recover(self, client: TelegramClient, account: str):
+        if not data_manager.get_setting("is_running"):
+            return
+        if not data_manager.get_setting("notifications"):
+            return
+
+        self.runs += 1
+        self.last_run_at = time.time()
+        for source_id in client_pool.served_by(account):
+            try:
+                await self.recover_source(client, source_id)
+            except FloodWaitError as e:
+                get_pacer(client).on_flood_wait(e.seconds)
+                logger.warning(
+                    f"Gap recovery postponed by FloodWait {e.seconds}s"
+                )
+                return
+            except Exception as e:
+                logger.error(f"Gap recovery error for {source_id}: {e}")
+
+    async def run(self, account: str):
+        """Запускает восстановление источников аккаунта сразу, после
+        каждого переподключения и раз в GAP_RECOVERY_INTERVAL секунд"""
+        if not settings.GAP_RECOVERY_ENABLED:
+            return
+
+        logger.info(f"Gap recovery started for account {account}")
+        was_connected = False
+        last_run = None
+        while True:
+            client = client_pool.get(account)
+            connected = client is not None and client.is_connected()
+            reconnected = connected and not was_connected
+            was_connected = connected
+
+            if connected and (
+                reconnected or
+                last_run is None or
+                time.monotonic() - last_run >= settings.GAP_RECOVERY_INTERVAL
+            ):
+                if reconnected and last_run is not None:
+                    logger.info("Client reconnected, recovering gaps")
+                await self.recover(client, account)
+                last_run = time.monotonic()
+
+            await asyncio.sleep(settings.GAP_RECOVERY_CHECK_INTERVAL)
+
+    def get_stats(self) -> Dict:
+        return {
+            "runs": self.runs,
+            "recovered": self.recovered,
+            "too_long": self.too_long,
+            "last_run_at": self.last_run_at,
+        }
+
+
+gap_recovery = GapRecovery()
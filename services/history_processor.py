@@ -1,41 +1,381 @@
 import asyncio
-from typing import Dict
-from telethon import TelegramClient
-from telethon.tl.functions.messages import GetHistoryRequest
+import html
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from telethon import TelegramClient, utils
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import GetHistoryRequest, SearchRequest
+from telethon.tl.types import InputMessagesFilterEmpty
 from config import settings
 from core.database import data_manager
-from services.keyword_matcher import find_keyword_in_text
-from services.notification import format_notification
-from core.bot import bot
+from services.notification import (
+    enqueue_notification,
+    format_notification
+)
+from services.archive import message_archive
+from services.dedup import notification_dedup
+from services.entity_cache import entity_cache, get_message_link
+from services.match_pool import match_texts
+from services.pacing import get_pacer
 from utils.logger import logger
 
 
-async def get_message_link(client, message) -> str:
+def index_batch_entities(history) -> Dict[int, object]:
+    """Собирает пользователей и чаты из ответа GetHistoryRequest
+    в словарь id -> entity и кладет их в общий кеш"""
+    entities = {}
+    for user in getattr(history, "users", []):
+        entities[user.id] = user
+    for chat in getattr(history, "chats", []):
+        entities[utils.get_peer_id(chat)] = chat
+
+    for entity_id, entity in entities.items():
+        entity_cache.put(entity_id, entity)
+
+    return entities
+
+
+class HistoryScanInterrupted(Exception):
+    pass
+
+
+async def fetch_pages(
+    client: TelegramClient,
+    source_id: int,
+    make_request: Callable[[int], object],
+    limit: Optional[int],
+    offset_id: int = 0,
+    since: Optional[datetime] = None
+) -> AsyncIterator:
+    """Постранично выполняет make_request(offset_id) (от новых сообщений
+    к старым) с учетом общего темпа аккаунта.
+
+    Загрузка останавливается после limit сообщений (None - без
+    ограничения) или на первой странице старше since."""
+    pacer = get_pacer(client)
+    fetched = 0
+
+    while limit is None or fetched < limit:
+        await pacer.wait()
+        try:
+            # FloodWait не обрабатывается внутри Telethon, чтобы
+            # темп подстраивался под реальные лимиты аккаунта
+            response = await client(
+                make_request(offset_id),
+                flood_sleep_threshold=0
+            )
+        except FloodWaitError as e:
+            pacer.on_flood_wait(e.seconds)
+            if e.seconds > settings.HISTORY_MAX_FLOOD_WAIT:
+                raise HistoryScanInterrupted(
+                    f"FloodWait {e.seconds}s for source {source_id} "
+                    "is too long"
+                )
+            continue
+
+        pacer.on_success()
+
+        if not response.messages:
+            return
+
+        yield response
+
+        fetched += len(response.messages)
+        if len(response.messages) < settings.MAX_MESSAGES_PER_REQUEST:
+            return
+        if since is not None and response.messages[-1].date < since:
+            return
+        offset_id = response.messages[-1].id
+
+
+def fetch_history_pages(
+    client: TelegramClient,
+    source_id: int,
+    offset_id: int,
+    min_id: int,
+    limit: Optional[int],
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> AsyncIterator:
+    # offset_date задает только начальную точку, дальше листаем по id
+    return fetch_pages(
+        client,
+        source_id,
+        lambda offset: GetHistoryRequest(
+            peer=source_id,
+            offset_id=offset,
+            offset_date=until if not offset else None,
+            add_offset=0,
+            limit=settings.MAX_MESSAGES_PER_REQUEST,
+            max_id=0,
+            min_id=min_id,
+            hash=0,
+        ),
+        limit,
+        offset_id,
+        since
+    )
+
+
+def fetch_search_pages(
+    client: TelegramClient,
+    source_id: int,
+    query: str,
+    min_id: int,
+    limit: Optional[int],
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> AsyncIterator:
+    return fetch_pages(
+        client,
+        source_id,
+        lambda offset: SearchRequest(
+            peer=source_id,
+            q=query,
+            filter=InputMessagesFilterEmpty(),
+            min_date=since,
+            max_date=until,
+            offset_id=offset,
+            add_offset=0,
+            limit=settings.MAX_MESSAGES_PER_REQUEST,
+            max_id=0,
+            min_id=min_id,
+            hash=0,
+        ),
+        limit,
+        since=since
+    )
+
+
+async def prefetch(items: AsyncIterator, size: int) -> AsyncIterator:
+    """Загружает до size элементов наперед в отдельной задаче, пока
+    потребитель обрабатывает текущий"""
+    queue = asyncio.Queue(maxsize=size)
+    done = object()
+
+    async def produce():
+        try:
+            async for item in items:
+                await queue.put((item, None))
+            await queue.put((done, None))
+        except Exception as e:
+            await queue.put((done, e))
+
+    producer = asyncio.create_task(produce())
     try:
-        chat = await client.get_entity(message.chat_id)
-        username = getattr(chat, "username", None)
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        producer.cancel()
 
-        if username:
-            return f"https://t.me/{username}/{message.id}"
-        else:
-            chat_id_str = str(message.chat_id).replace("-100", "")
-            return f"https://t.me/c/{chat_id_str}/{message.id}"
+
+async def notify_history_match(
+    client: TelegramClient,
+    message,
+    hits,
+    entities: Dict[int, object],
+    source_data: Dict,
+    recipients: List[int]
+):
+    keywords = [hit.keyword for hit in hits]
+    if notification_dedup.is_duplicate(message, keywords):
+        return
+
+    try:
+        await send_history_match(
+            client,
+            message,
+            hits,
+            entities,
+            source_data,
+            recipients
+        )
     except Exception:
+        notification_dedup.release(message)
+        raise
+    notification_dedup.record(message, keywords)
+
+
+async def send_history_match(
+    client: TelegramClient,
+    message,
+    hits,
+    entities: Dict[int, object],
+    source_data: Dict,
+    recipients: List[int]
+):
+    sender_id = message.sender_id
+    sender = entities.get(sender_id)
+    if sender is None:
+        sender = await entity_cache.get_sender(client, message)
+    sender_name = getattr(sender, "first_name", "Unknown")
+    last_name = getattr(sender, "last_name", "")
+    if last_name:
+        sender_name += f" {last_name}"
+    sender_username = getattr(sender, "username", None)
+
+    message_link = await get_message_link(client, message, source_data)
+
+    parent_channel = None
+    if source_data["type"] == "discussion":
+        parent_id = source_data.get("parent_channel")
+        if parent_id:
+            parent_data = data_manager.get_data()["sources"].get(
+                str(parent_id)
+            )
+            if parent_data:
+                parent_channel = parent_data["title"]
+
+    notification_text, keyboard = format_notification(
+        hits=hits,
+        sender_id=sender_id,
+        sender_name=sender_name,
+        sender_username=sender_username,
+        source_type=source_data["type"],
+        source_title=source_data["title"],
+        source_username=source_data.get("username"),
+        message_text=message.message,
+        message_link=message_link,
+        parent_channel=parent_channel
+    )
+
+    await enqueue_notification(recipients, notification_text, keyboard)
+
+
+HISTORY_MODES = ("download", "search")
+
+
+def from_timestamp(value: Optional[float]) -> Optional[datetime]:
+    if value is None:
         return None
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+def to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value else None
+
+
+def checkpoint_matches(
+    checkpoint: Dict,
+    mode: str,
+    incremental: bool,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    keywords: Optional[List[str]]
+) -> bool:
+    """Запрошено ли то же сканирование, что сохранено в checkpoint"""
+    return (
+        checkpoint.get("mode", "download") == mode and
+        checkpoint["incremental"] == incremental and
+        checkpoint.get("since") == to_timestamp(since) and
+        checkpoint.get("until") == to_timestamp(until) and
+        checkpoint.get("keywords") == keywords
+    )
+
+
+def format_keywords(keywords: Optional[List[str]]) -> str:
+    if not keywords:
+        return ""
+    return f"🔑 Слова: {html.escape(', '.join(keywords))}\n"
+
+
+def format_date_range(
+    since: Optional[datetime],
+    until: Optional[datetime]
+) -> str:
+    if since is None and until is None:
+        return ""
+    text = "📅 Период:"
+    if since is not None:
+        text += f" с {since:%d.%m.%Y %H:%M}"
+    if until is not None:
+        text += f" до {until:%d.%m.%Y %H:%M}"
+    return text + " (UTC)\n"
 
 
 async def process_source_history(
     client: TelegramClient,
     source_id: int,
-    admin_id: int
+    admin_id: Optional[int],
+    incremental: bool = False,
+    stats: Optional[Dict[str, int]] = None,
+    mode: str = "download",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    keywords: Optional[List[str]] = None,
+    resume: bool = False
 ) -> Dict[str, int]:
+    """Обрабатывает историю источника.
 
-    logger.info(f"Processing history for source {source_id}")
+    incremental: запрашиваются только сообщения новее сохраненного
+    last_message_id источника (min_id).
+    admin_id: None - уведомления получают все админы, итог не
+    отправляется (фоновая догрузка).
+    mode: download - загрузка всей истории и локальный поиск,
+    search - серверный поиск (messages.search) по каждому ключевому
+    слову с подтверждением локальным поиском.
+    since/until: обрабатываются только сообщения из этого интервала,
+    при заданном since ограничение HISTORY_MESSAGES_LIMIT не действует.
+    keywords: искать только эти слова (догрузка совпадений для новых
+    слов), флаг processed и last_message_id при этом не меняются.
 
-    result = {"processed": 0, "matches": 0}
+    После каждой пачки позиция сохраняется, прерванное сканирование
+    продолжается с нее при следующем запуске с теми же параметрами.
+    resume: продолжить сохраненное сканирование с его параметрами.
+    Иначе сохраненное сканирование с другими параметрами отбрасывается.
+    stats: словарь, в котором по ходу работы обновляются счетчики."""
 
-    if data_manager.is_source_processed(source_id):
-        logger.info(f"Source {source_id} already processed")
+    result = stats if stats is not None else {}
+    result.update(processed=0, matches=0, transferred=0)
+
+    checkpoint = data_manager.get_history_checkpoint(source_id)
+    replaced = False
+    if checkpoint and not resume and not checkpoint_matches(
+        checkpoint, mode, incremental, since, until, keywords
+    ):
+        logger.info(
+            f"Discarding interrupted history scan for source {source_id}: "
+            "new scan parameters differ"
+        )
+        data_manager.clear_history_checkpoint(source_id)
+        checkpoint = None
+        replaced = True
+
+    notify_resume = bool(checkpoint) and admin_id is not None
+    if checkpoint:
+        logger.info(
+            f"Resuming history for source {source_id} "
+            f"from offset {checkpoint['offset_id']}"
+        )
+        incremental = checkpoint["incremental"]
+        mode = checkpoint.get("mode", "download")
+        since = from_timestamp(checkpoint.get("since"))
+        until = from_timestamp(checkpoint.get("until"))
+        keywords = checkpoint.get("keywords")
+        if admin_id is None:
+            admin_id = checkpoint.get("admin_id")
+    else:
+        logger.info(
+            f"Processing history for source {source_id} ({mode}"
+            f"{', incremental' if incremental else ''})"
+        )
+        if (
+            not incremental and
+            keywords is None and
+            data_manager.is_source_processed(source_id)
+        ):
+            logger.info(f"Source {source_id} already processed")
+            return result
+
+    if mode not in HISTORY_MODES:
+        logger.error(f"Unknown history mode: {mode}")
         return result
 
     try:
@@ -46,134 +386,226 @@ async def process_source_history(
             logger.error(f"Source {source_id} not found")
             return result
 
-        keywords = data_manager.get_keywords()
-        if not keywords:
+        # Слова бота сопоставляются в текущей версии, keywords задачи -
+        # отдельным набором (services.match_pool)
+        queries = [k for k in keywords or data_manager.get_keywords() if k]
+        if not queries:
             logger.warning("No keywords to search")
             return result
 
-        offset_id = 0
-        total_processed = 0
+        if admin_id is not None:
+            recipients = [admin_id]
+        else:
+            recipients = data_manager.get_setting("admins")
 
-        while total_processed < settings.HISTORY_MESSAGES_LIMIT:
-            try:
-                history = await client(
-                    GetHistoryRequest(
-                        peer=source_id,
-                        offset_id=offset_id,
-                        offset_date=None,
-                        add_offset=0,
-                        limit=settings.MAX_MESSAGES_PER_REQUEST,
-                        max_id=0,
-                        min_id=0,
-                        hash=0,
+        if replaced and admin_id is not None:
+            await enqueue_notification(
+                [admin_id],
+                f"ℹ️ Прерванное сканирование источника "
+                f"{source_data['title']} отменено: запрошено "
+                "сканирование с другими параметрами."
+            )
+        elif notify_resume:
+            await enqueue_notification(
+                [admin_id],
+                f"ℹ️ Источник {source_data['title']}: продолжается "
+                f"прерванное сканирование ({checkpoint['processed']} "
+                "сообщений уже обработано)."
+            )
+
+        if checkpoint:
+            min_id = checkpoint["min_id"]
+            newest_id = checkpoint["newest_id"]
+            offset_id = checkpoint["offset_id"]
+            keyword_index = checkpoint.get("keyword_index", 0)
+            started_at = checkpoint["started_at"]
+            result["processed"] = checkpoint["processed"]
+            result["matches"] = checkpoint["matches"]
+            result["transferred"] = checkpoint.get("transferred", 0)
+        else:
+            min_id = 0
+            if incremental:
+                min_id = data_manager.get_source_watermark(source_id)
+            newest_id = min_id
+            offset_id = 0
+            keyword_index = 0
+            started_at = time.time()
+
+        seen_ids = set()
+
+        async def process_page(response):
+            entities = index_batch_entities(response)
+            message_archive.add(source_id, response.messages)
+
+            messages = []
+            for message in response.messages:
+                result["transferred"] += 1
+                if message.id in seen_ids:
+                    continue
+                if since is not None and message.date < since:
+                    continue
+                if until is not None and message.date >= until:
+                    continue
+                if mode == "search":
+                    seen_ids.add(message.id)
+                result["processed"] += 1
+
+                if getattr(message, "message", None):
+                    messages.append(message)
+
+            if not messages:
+                return
+            found = await match_texts(
+                [message.message for message in messages],
+                keywords
+            )
+
+            for message, hits in zip(messages, found):
+                if not hits:
+                    continue
+
+                result["matches"] += 1
+                try:
+                    await notify_history_match(
+                        client,
+                        message,
+                        hits,
+                        entities,
+                        source_data,
+                        recipients
                     )
-                )
+                except Exception as e:
+                    logger.error(f"Error queueing notification: {e}")
 
-                if not history.messages:
-                    break
-
-                for message in history.messages:
-                    total_processed += 1
-                    result["processed"] += 1
-
-                    text = getattr(message, "message", None)
-                    if not text:
-                        continue
-
-                    keyword = find_keyword_in_text(text, keywords)
-                    if keyword:
-                        result["matches"] += 1
-
-                        try:
-                            sender = await message.get_sender()
-                            sender_id = message.sender_id
-                            sender_name = getattr(
-                                sender, "first_name", "Unknown"
-                            )
-                            last_name = getattr(sender, "last_name", "")
-                            if last_name:
-                                sender_name += f" {last_name}"
-                            sender_username = getattr(
-                                sender, "username", None
-                            )
-
-                            message_link = await get_message_link(
-                                client, message
-                            )
-
-                            parent_channel = None
-                            if source_data["type"] == "discussion":
-                                parent_id = source_data.get(
-                                    "parent_channel"
-                                )
-                                if parent_id:
-                                    parent_data = data_manager.get_data()[
-                                        "sources"
-                                    ].get(str(parent_id))
-                                    if parent_data:
-                                        parent_channel = parent_data[
-                                            "title"
-                                        ]
-
-                            notification_text, keyboard = (
-                                format_notification(
-                                    keyword=keyword,
-                                    sender_id=sender_id,
-                                    sender_name=sender_name,
-                                    sender_username=sender_username,
-                                    source_type=source_data["type"],
-                                    source_title=source_data["title"],
-                                    source_username=source_data.get(
-                                        "username"
-                                    ),
-                                    message_text=text,
-                                    message_link=message_link,
-                                    parent_channel=parent_channel
-                                )
-                            )
-
-                            await bot.send_message(
-                                admin_id,
-                                notification_text,
-                                parse_mode="HTML",
-                                reply_markup=keyboard
-                            )
-
-                        except Exception as e:
-                            logger.error(
-                                f"Error sending notification: {e}"
-                            )
-
-                if len(history.messages) < (
-                    settings.MAX_MESSAGES_PER_REQUEST
-                ):
-                    break
-
-                offset_id = history.messages[-1].id
-
-                if total_processed >= settings.HISTORY_MESSAGES_LIMIT:
-                    break
-
-                await asyncio.sleep(settings.BATCH_DELAY)
+        def save_checkpoint():
+            data_manager.save_history_checkpoint(source_id, {
+                "mode": mode,
+                "offset_id": offset_id,
+                "keyword_index": keyword_index,
+                "min_id": min_id,
+                "newest_id": newest_id,
+                "incremental": incremental,
+                "admin_id": admin_id,
+                "processed": result["processed"],
+                "matches": result["matches"],
+                "transferred": result["transferred"],
+                "started_at": started_at,
+                "since": to_timestamp(since),
+                "until": to_timestamp(until),
+                "keywords": keywords,
+            })
 
-            except Exception as e:
-                logger.error(f"Error fetching history batch: {e}")
-                break
+        limit = None
+        if since is None:
+            limit = settings.HISTORY_MESSAGES_LIMIT
 
-        data_manager.mark_source_processed(source_id)
+        completed = False
+        try:
+            if mode == "download":
+                pages = prefetch(
+                    fetch_history_pages(
+                        client,
+                        source_id,
+                        offset_id,
+                        min_id,
+                        limit - result["processed"] if limit else None,
+                        since,
+                        until
+                    ),
+                    settings.HISTORY_PREFETCH
+                )
+                try:
+                    async for history in pages:
+                        newest_id = max(newest_id, history.messages[0].id)
+                        await process_page(history)
+                        offset_id = history.messages[-1].id
+                        save_checkpoint()
+                finally:
+                    await pages.aclose()
+            else:
+                # Одно сообщение может найтись по нескольким словам,
+                # повторы отсекаются по id через seen_ids
+                while keyword_index < len(queries):
+                    pages = prefetch(
+                        fetch_search_pages(
+                            client,
+                            source_id,
+                            queries[keyword_index],
+                            min_id,
+                            limit,
+                            since,
+                            until
+                        ),
+                        settings.HISTORY_PREFETCH
+                    )
+                    try:
+                        async for response in pages:
+                            await process_page(response)
+                    finally:
+                        await pages.aclose()
+                    keyword_index += 1
+                    save_checkpoint()
+            completed = True
+        except Exception as e:
+            logger.error(f"Error fetching history batch: {e}")
+
+        if not completed:
+            logger.warning(
+                f"History scan for {source_id} interrupted at offset "
+                f"{offset_id}, it will be resumed"
+            )
+            if admin_id is not None:
+                await enqueue_notification(
+                    [admin_id],
+                    f"⚠️ <b>Обработка истории прервана</b>\n\n"
+                    f"📊 Источник: {source_data['title']}\n"
+                    f"📝 Обработано сообщений: {result['processed']}\n"
+                    "Сканирование продолжится с места остановки "
+                    "при следующем запуске."
+                )
+            return result
+
+        # Поиск и загрузка с until видят не все новые сообщения, поэтому
+        # last_message_id обновляется только после обычной загрузки
+        if mode == "download" and until is None and keywords is None:
+            data_manager.update_source_watermark(source_id, newest_id)
+        data_manager.clear_history_checkpoint(source_id)
+        if keywords is None:
+            data_manager.mark_source_processed(source_id)
+        # Полная загрузка при включенном архиве сохранила в него ту же
+        # историю, которую просматривает поиск, новые сообщения в архив
+        # добавляет мониторинг
+        if (
+            mode == "download" and
+            not incremental and
+            since is None and
+            until is None and
+            keywords is None and
+            message_archive.enabled
+        ):
+            data_manager.mark_source_archived(source_id)
         logger.info(
-            f"History processed: {result['processed']} messages, "
+            f"History processed ({mode}): {result['processed']} messages, "
+            f"{result['transferred']} transferred, "
             f"{result['matches']} matches"
         )
 
+        if admin_id is None:
+            return result
+
+        mode_title = "поиск" if mode == "search" else "загрузка"
         try:
-            await bot.send_message(
-                admin_id,
+            await enqueue_notification(
+                [admin_id],
                 f"✅ <b>Обработка истории завершена</b>\n\n"
                 f"📊 Источник: {source_data['title']}\n"
+                f"⚙️ Режим: {mode_title}\n"
+                f"{format_keywords(keywords)}"
+                f"{format_date_range(since, until)}"
+                f"📦 Загружено сообщений: {result['transferred']}\n"
                 f"📝 Обработано сообщений: {result['processed']}\n"
-                f"🔍 Найдено совпадений: {result['matches']}",
-                parse_mode="HTML"
+                f"🔍 Найдено совпадений: {result['matches']}\n"
+                f"⏱ Время: {time.time() - started_at:.0f} с"
             )
         except Exception as e:
             logger.error(f"Error sending summary: {e}")
@@ -181,4 +613,82 @@ async def process_source_history(
     except Exception as e:
         logger.error(f"Error processing history for {source_id}: {e}")
 
-    return result
\ No newline at end of file
+    return result
+
+
+async def rematch_archive(
+    client: TelegramClient,
+    admin_id: Optional[int],
+    keywords: Optional[List[str]] = None,
+    source_ids: Optional[List[int]] = None
+) -> Dict[str, int]:
+    """Сопоставляет локальный архив источников с ключевыми словами без
+    загрузки истории из Telegram.
+
+    keywords: по умолчанию текущий набор ключевых слов.
+    admin_id: получатель итогов; None - без итогового сообщения,
+    совпадения отправляются всем администраторам."""
+    result = {"sources": 0, "processed": 0, "matches": 0}
+    if not (keywords or data_manager.get_keywords()):
+        logger.warning("No keywords to search")
+        return result
+
+    if admin_id is not None:
+        recipients = [admin_id]
+    else:
+        recipients = data_manager.get_setting("admins")
+
+    started_at = time.time()
+    sources = data_manager.get_data()["sources"]
+    if source_ids is None:
+        source_ids = data_manager.get_all_source_ids()
+
+    for source_id in source_ids:
+        source_data = sources.get(str(source_id))
+        if not source_data or not message_archive.has_source(source_id):
+            continue
+
+        try:
+            scanned, found = await message_archive.match(
+                source_id,
+                partial(match_texts, keywords=keywords)
+            )
+        except Exception as e:
+            logger.error(f"Error matching archive of {source_id}: {e}")
+            continue
+
+        result["sources"] += 1
+        result["processed"] += scanned
+        for message, hits in found:
+            result["matches"] += 1
+            try:
+                await notify_history_match(
+                    client,
+                    message,
+                    hits,
+                    {},
+                    source_data,
+                    recipients
+                )
+            except Exception as e:
+                logger.error(f"Error sending notification: {e}")
+
+    logger.info(
+        f"Archive re-matched: {result['processed']} messages in "
+        f"{result['sources']} sources, {result['matches']} matches"
+    )
+
+    if admin_id is not None:
+        try:
+            await enqueue_notification(
+                [admin_id],
+                f"✅ <b>Поиск по архиву завершен</b>\n\n"
+                f"📊 Источников: {result['sources']}\n"
+                f"📝 Обработано сообщений: {result['processed']}\n"
+                f"🔍 Найдено совпадений: {result['matches']}\n"
+                f"⏱ Время: {time.time() - started_at:.0f} с"
+            )
+        except Exception as e:
+            logger.error(f"Error sending summary: {e}")
+
+    return result
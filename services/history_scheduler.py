@@ -0,0 +1,233 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from telethon import TelegramClient
+from config import settings
+from core.client import client_pool
+from core.database import data_manager
+from services.history_processor import process_source_history
+from utils.logger import logger
+
+
+PRIORITY_MANUAL = 0
+PRIORITY_BACKGROUND = 10
+
+
+class HistoryJob:
+    def __init__(
+        self,
+        job_id: int,
+        account: str,
+        client,
+        source_id: int,
+        title: str,
+        admin_id: Optional[int],
+        priority: int,
+        kwargs: Dict
+    ):
+        self.id = job_id
+        self.account = account
+        self.client = client
+        self.source_id = source_id
+        self.title = title
+        self.admin_id = admin_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stats = {"processed": 0, "matches": 0}
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_requested = False
+        self._done = asyncio.Event()
+
+    async def wait(self):
+        """Ждет завершения задачи с любым статусом"""
+        await self._done.wait()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return self.stats["processed"] / elapsed if elapsed else 0.0
+
+
+class HistoryScheduler:
+    """Очередь задач обработки истории с защитой от повторного запуска
+    одного источника.
+
+    У каждого аккаунта пула свой лимит запросов, поэтому у него своя
+    очередь и не больше concurrency одновременных сканирований"""
+
+    def __init__(self, concurrency: int, finished_limit: int = 50):
+        self.concurrency = concurrency
+        self._queues: Dict[str, asyncio.PriorityQueue] = {}
+        self._workers: Dict[str, List[asyncio.Task]] = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._active: Dict[int, HistoryJob] = {}
+        self.finished: deque = deque(maxlen=finished_limit)
+
+    def _get_queue(self, account: str) -> asyncio.PriorityQueue:
+        queue = self._queues.get(account)
+        if queue is None:
+            queue = self._queues[account] = asyncio.PriorityQueue()
+            self._workers[account] = [
+                asyncio.create_task(self._worker(queue))
+                for _ in range(self.concurrency)
+            ]
+        return queue
+
+    def submit(
+        self,
+        client,
+        source_id: int,
+        title: str,
+        admin_id: Optional[int],
+        priority: int = PRIORITY_MANUAL,
+        **kwargs
+    ) -> Optional[HistoryJob]:
+        """Ставит источник в очередь. Возвращает None, если источник
+        уже ожидает или обрабатывается.
+
+        Задача выполняется аккаунтом, обслуживающим источник, client
+        используется, если у пула нет его клиента"""
+        source_id = int(source_id)
+        if source_id in self._active:
+            logger.info(f"History job for {source_id} already scheduled")
+            return None
+
+        account = client_pool.serving_account(source_id)
+        client = client_pool.get(account) or client
+        job = HistoryJob(
+            next(self._ids),
+            account,
+            client,
+            source_id,
+            title,
+            admin_id,
+            priority,
+            kwargs
+        )
+        self._active[source_id] = job
+        self._get_queue(account).put_nowait((priority, next(self._seq), job))
+        logger.info(f"History job #{job.id} queued for source {source_id}")
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        for job in self._active.values():
+            if job.id != job_id:
+                continue
+            # Отмененное админом сканирование не продолжается при
+            # следующем запуске
+            job.cancel_requested = True
+            if job.status == "queued":
+                # Задача будет пропущена обработчиком очереди
+                data_manager.clear_history_checkpoint(job.source_id)
+                self._finish(job, "cancelled")
+            elif job.task is not None:
+                job.task.cancel()
+            return True
+        return False
+
+    def get_active(self, source_id: int) -> Optional[HistoryJob]:
+        """Ожидающая или выполняемая задача источника"""
+        return self._active.get(int(source_id))
+
+    def get_jobs(self) -> List[HistoryJob]:
+        active = sorted(
+            self._active.values(),
+            key=lambda job: (job.status != "running", job.priority, job.id)
+        )
+        return active + list(reversed(self.finished))
+
+    def _finish(self, job: HistoryJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if self._active.get(job.source_id) is job:
+            del self._active[job.source_id]
+        self.finished.append(job)
+        job._done.set()
+
+    async def _worker(self, queue: asyncio.PriorityQueue):
+        while True:
+            _, _, job = await queue.get()
+            try:
+                if job.status != "queued":
+                    continue
+                await self._run(job)
+            finally:
+                queue.task_done()
+
+    async def _run(self, job: HistoryJob):
+        job.status = "running"
+        job.started_at = time.time()
+        job.task = asyncio.create_task(
+            process_source_history(
+                job.client,
+                job.source_id,
+                job.admin_id,
+                stats=job.stats,
+                **job.kwargs
+            )
+        )
+
+        try:
+            await job.task
+        except asyncio.CancelledError:
+            if not job.task.cancelled():
+                raise
+            logger.info(f"History job #{job.id} cancelled")
+            # При остановке бота позиция сохраняется для продолжения
+            if job.cancel_requested:
+                data_manager.clear_history_checkpoint(job.source_id)
+            self._finish(job, "cancelled")
+        except Exception as e:
+            logger.error(f"History job #{job.id} failed: {e}")
+            self._finish(job, "failed")
+        else:
+            self._finish(job, "finished")
+
+
+history_scheduler = HistoryScheduler(settings.HISTORY_CONCURRENCY)
+
+
+def resume_history_scans(client: TelegramClient):
+    """Продолжает сканирования, прерванные перезапуском или ошибкой"""
+    sources = data_manager.get_data()["sources"]
+    for source_id in data_manager.get_checkpointed_source_ids():
+        history_scheduler.submit(
+            client,
+            source_id,
+            sources[str(source_id)]["title"],
+            None,
+            priority=PRIORITY_BACKGROUND,
+            resume=True
+        )
+
+
+def catch_up_sources(client: TelegramClient):
+    """Догружает сообщения, пришедшие пока бот был выключен, для всех
+    источников с сохраненным last_message_id"""
+    sources = data_manager.get_data()["sources"]
+    for source_id in data_manager.get_all_source_ids():
+        if not data_manager.get_source_watermark(source_id):
+            continue
+        if data_manager.get_history_checkpoint(source_id):
+            continue
+        history_scheduler.submit(
+            client,
+            source_id,
+            sources[str(source_id)]["title"],
+            None,
+            priority=PRIORITY_BACKGROUND,
+            incremental=True
+        )
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import settings
+from utils.logger import logger
+
+
+OVERFLOW_POLICIES = ("block", "drop_new", "drop_oldest")
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class IngestionQueue:
+    """Ограниченная очередь между событиями Telethon и пулом
+    обработчиков (сопоставление, обогащение, отправка).
+
+    Telethon запускает каждый апдейт отдельной задачей, поэтому
+    ожидание места в очереди (политика block) само по себе не
+    ограничивает память: ждущих задач может быть сколько угодно.
+    Число одновременно работающих обработчиков апдейтов ограничено
+    max_in_flight (admit/release), апдейты сверх него отбрасываются и
+    учитываются в dropped. Пропущенные сообщения каналов затем
+    догружает восстановление пропусков."""
+
+    def __init__(
+        self,
+        max_size: int,
+        workers: int,
+        overflow_policy: str = "block",
+        max_in_flight: int = 0
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.max_size = max_size
+        self.workers = workers
+        self.overflow_policy = overflow_policy
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._handler: Optional[Callable[..., Awaitable]] = None
+        self._drop_handler: Optional[Callable] = None
+
+        self.accepted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.stages: Dict[str, StageStats] = {}
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(
+        self,
+        handler: Callable[..., Awaitable],
+        drop_handler: Optional[Callable] = None
+    ):
+        """drop_handler вызывается для элемента, вытесненного из
+        очереди политикой drop_oldest"""
+        if self.is_running:
+            return
+
+        self._handler = handler
+        self._drop_handler = drop_handler
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(i))
+            for i in range(self.workers)
+        ]
+        logger.info(
+            f"Ingestion queue started: {self.workers} workers, "
+            f"size {self.max_size}, policy {self.overflow_policy}"
+        )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def admit(self) -> bool:
+        """Резервирует место для обработчика апдейта. При False апдейт
+        отброшен, иначе обработчик обязан вызвать release"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            self.dropped += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    async def put(self, item) -> bool:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+
+        entry = (time.monotonic(), item)
+
+        if self.overflow_policy == "block":
+            await self._queue.put(entry)
+        else:
+            try:
+                self._queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                if self.overflow_policy == "drop_new":
+                    self.dropped += 1
+                    return False
+                # drop_oldest: освобождаем место под свежее сообщение
+                _, dropped = self._queue.get_nowait()
+                self._queue.task_done()
+                self.dropped += 1
+                self._queue.put_nowait(entry)
+                if self._drop_handler is not None:
+                    self._drop_handler(dropped)
+
+        self.accepted += 1
+        return True
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - started)
+
+    def record(self, stage: str, seconds: float):
+        self.stages.setdefault(stage, StageStats()).add(seconds)
+
+    async def _worker(self, number: int):
+        while True:
+            enqueued_at, item = await self._queue.get()
+            try:
+                self.record("queue", time.monotonic() - enqueued_at)
+                with self.timed("total"):
+                    await self._handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ingestion worker {number} error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def get_stats(self) -> Dict:
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "max_size": self.max_size,
+            "workers": len(self._tasks),
+            "in_flight": self.in_flight,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "stages": {
+                name: {
+                    "count": stage.count,
+                    "avg": stage.avg,
+                    "max": stage.max,
+                }
+                for name, stage in self.stages.items()
+            },
+        }
+
+
+ingestion_queue = IngestionQueue(
+    settings.INGESTION_QUEUE_SIZE,
+    settings.INGESTION_WORKERS,
+    settings.INGESTION_OVERFLOW_POLICY,
+    settings.INGESTION_MAX_IN_FLIGHT
+)
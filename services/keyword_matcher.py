@@ -1,14 +1,122 @@
-from typing import List, Optional
+import asyncio
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
 
-def find_keyword_in_text(text: str, keywords: List[str]) -> Optional[str]:
-    if not text or not keywords:
-        return None
+class KeywordHit(NamedTuple):
+    keyword: str
+    spans: List[Tuple[int, int]]
 
-    text_lower = text.lower()
 
-    for keyword in keywords:
-        if keyword.lower() in text_lower:
-            return keyword
+class KeywordMatcher:
+    """Aho-Corasick автомат по списку ключевых слов (без учета регистра)"""
+
+    def __init__(self, keywords: List[str]):
+        self.keywords = [k for k in keywords if k]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        self._lengths: List[int] = []
+
+        for index, keyword in enumerate(self.keywords):
+            pattern = keyword.lower()
+            self._lengths.append(len(pattern))
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = next_node
+            self._out[node] += (index,)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] += self._out[self._fail[child]]
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def _scan(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Выдает (индекс ключевого слова, начало, конец совпадения)"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        lengths = self._lengths
+        node = 0
+        # lower() может вернуть несколько символов (İ), поэтому для
+        # каждого символа в нижнем регистре хранится позиция в исходном
+        # тексте
+        origins: List[int] = []
+
+        for position, original in enumerate(text):
+            for char in original.lower():
+                origins.append(position)
+                while node and char not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(char, 0)
+                for index in out[node]:
+                    start = origins[len(origins) - lengths[index]]
+                    yield index, start, position + 1
+
+    def find_all(self, text: str) -> List[KeywordHit]:
+        """Все найденные ключевые слова с позициями (start, end) в тексте,
+        упорядоченные по первому вхождению"""
+        if not text or not self.keywords:
+            return []
+
+        spans: Dict[int, List[Tuple[int, int]]] = {}
+        for index, start, end in self._scan(text):
+            spans.setdefault(index, []).append((start, end))
+
+        hits = [
+            KeywordHit(self.keywords[index], index_spans)
+            for index, index_spans in spans.items()
+        ]
+        hits.sort(key=lambda hit: hit.spans[0])
+        return hits
+
+
+_matcher: Optional[KeywordMatcher] = None
+_matcher_version: Optional[int] = None
+_build: Optional[Tuple[int, asyncio.Future]] = None
+
+
+async def get_matcher() -> KeywordMatcher:
+    """Скомпилированный автомат слов бота. Пересобирается только при
+    изменении списка ключевых слов, в потоке, чтобы не останавливать
+    цикл; одновременные вызовы ждут одну сборку"""
+    global _matcher, _matcher_version, _build
+
+    # Импорт здесь, чтобы процессы сопоставления (services.match_worker)
+    # могли использовать автомат без загрузки данных бота
+    from core.database import data_manager
+
+    version = data_manager.keywords_version
+    if _matcher is not None and _matcher_version == version:
+        return _matcher
+
+    if _build is None or _build[0] != version:
+        loop = asyncio.get_running_loop()
+        _build = (version, loop.run_in_executor(
+            None,
+            KeywordMatcher,
+            list(data_manager.get_keywords())
+        ))
+    matcher = await _build[1]
+
+    if _matcher_version is None or version > _matcher_version:
+        _matcher = matcher
+        _matcher_version = version
+    return matcher
 
-    return None
\ No newline at end of file
@@ -0,0 +1,381 @@
+import asyncio
+import hashlib
+import os
+import select
+import subprocess
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from config import settings
+from services.keyword_matcher import KeywordHit, KeywordMatcher, get_matcher
+from services.match_worker import read_frame, write_frame
+from utils.logger import logger
+
+
+WORKER_MODULE = "services.match_worker"
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Число наборов ключевых слов, автоматы которых хранит процесс
+KEYWORD_SETS = 8
+
+
+def current_keywords() -> Tuple[int, List[str]]:
+    """Версия и список ключевых слов бота"""
+    # Импорт здесь, чтобы бенчмарк мог создать пул без данных бота
+    from core.database import data_manager
+    return data_manager.keywords_version, data_manager.get_keywords()
+
+
+def keyword_set_key(keywords: List[str]) -> str:
+    """Ключ отдельного набора слов (задачи истории, догрузки)"""
+    return "set:" + hashlib.blake2b(
+        "\n".join(keywords).encode("utf-8"),
+        digest_size=8
+    ).hexdigest()
+
+
+class MatchWorker:
+    """Процесс services.match_worker. Запускается отдельным
+    интерпретатором, а не multiprocessing, чтобы не импортировать
+    заново main.py (бот, обработчики, базу данных)"""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", WORKER_MODULE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=PROJECT_ROOT
+        )
+        # Наборы слов, переданные процессу, в порядке использования
+        self.keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def request(
+        self,
+        key: str,
+        keywords: List[str],
+        texts: List[str],
+        timeout: float
+    ) -> List[List[KeywordHit]]:
+        """Сопоставляет тексты с набором key. TimeoutError, если процесс
+        не ответил за timeout секунд"""
+        if key in self.keys:
+            self.keys.move_to_end(key)
+        else:
+            write_frame(self.process.stdin, ("keywords", (key, keywords)))
+            self.keys[key] = None
+            while len(self.keys) > KEYWORD_SETS:
+                old_key, _ = self.keys.popitem(last=False)
+                write_frame(self.process.stdin, ("forget", old_key))
+
+        write_frame(self.process.stdin, ("match", (key, texts)))
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f"Match worker did not answer in {timeout}s")
+        return read_frame(self.process.stdout)
+
+    def stop(self):
+        try:
+            write_frame(self.process.stdin, ("stop", None))
+            self.process.stdin.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class MatchPool:
+    """Сопоставление ключевых слов в отдельных процессах.
+
+    Тексты, пришедшие почти одновременно, собираются в пачки до
+    batch_size и отправляются свободному процессу. Пачка относится к
+    одному набору слов: текущим словам бота или набору задачи истории.
+    Автомат строится только в процессах: новый набор или новая версия
+    слов бота передается процессу перед первой пачкой с ним. Процесс,
+    упавший или не ответивший за timeout секунд, перезапускается, а его
+    пачка при повторной ошибке сопоставляется в потоке."""
+
+    def __init__(
+        self,
+        workers: int,
+        batch_size: int,
+        batch_delay: float,
+        keywords_source: Callable[
+            [], Tuple[int, List[str]]
+        ] = current_keywords,
+        timeout: float = 10.0
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.keywords_source = keywords_source
+        self.timeout = timeout
+        self._workers: List[MatchWorker] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[
+            str, Tuple[List[str], List[Tuple[str, asyncio.Future]]]
+        ] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._version: Optional[int] = None
+        self._keywords: List[str] = []
+        self._fallback: "OrderedDict[str, KeywordMatcher]" = OrderedDict()
+
+        self.batches = 0
+        self.texts = 0
+        self.restarts = 0
+        self.fallbacks = 0
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        if self.is_running or self.workers <= 0:
+            return
+
+        self._workers = [MatchWorker() for _ in range(self.workers)]
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._idle = asyncio.Queue()
+        for worker in self._workers:
+            self._idle.put_nowait(worker)
+        logger.info(f"Match pool started: {self.workers} processes")
+
+    def stop(self):
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _keyword_set(
+        self,
+        keywords: Optional[List[str]]
+    ) -> Tuple[str, List[str]]:
+        if keywords is None:
+            version, current = self._current_keywords()
+            return f"bot:{version}", current
+        keywords = list(keywords)
+        return keyword_set_key(keywords), keywords
+
+    async def find_all(
+        self,
+        text: str,
+        keywords: Optional[List[str]] = None
+    ) -> List[KeywordHit]:
+        """keywords: набор слов задачи, по умолчанию слова бота"""
+        return await self._submit(*self._keyword_set(keywords), text)
+
+    async def find_all_many(
+        self,
+        texts: List[str],
+        keywords: Optional[List[str]] = None
+    ) -> List[List[KeywordHit]]:
+        key, keywords = self._keyword_set(keywords)
+        return list(await asyncio.gather(
+            *(self._submit(key, keywords, text) for text in texts)
+        ))
+
+    def _submit(
+        self,
+        key: str,
+        keywords: List[str],
+        text: str
+    ) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(key, (keywords, []))[1]
+        batch.append((text, future))
+
+        if len(batch) >= self.batch_size:
+            self._dispatch_pending(key)
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_delay,
+                self._flush
+            )
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        for key in list(self._pending):
+            self._dispatch_pending(key)
+
+    def _dispatch_pending(self, key: str):
+        keywords, batch = self._pending.pop(key)
+        asyncio.create_task(self._dispatch(key, keywords, batch))
+
+    def _current_keywords(self) -> Tuple[int, List[str]]:
+        version, keywords = self.keywords_source()
+        if version != self._version:
+            # Копия, чтобы список не менялся, пока его читает поток
+            self._version = version
+            self._keywords = list(keywords)
+        return self._version, self._keywords
+
+    async def _request(
+        self,
+        worker: MatchWorker,
+        key: str,
+        keywords: List[str],
+        texts: List[str]
+    ) -> List[List[KeywordHit]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            worker.request,
+            key,
+            keywords,
+            texts,
+            self.timeout
+        )
+
+    async def _restart(self, worker: MatchWorker) -> MatchWorker:
+        worker.kill()
+        loop = asyncio.get_running_loop()
+        new_worker = await loop.run_in_executor(self._executor, MatchWorker)
+        self._workers[self._workers.index(worker)] = new_worker
+        self.restarts += 1
+        return new_worker
+
+    def _match_local(
+        self,
+        key: str,
+        keywords: List[str],
+        texts: List[str]
+    ) -> Tuple[List[List[KeywordHit]], KeywordMatcher]:
+        matcher = self._fallback.get(key)
+        if matcher is None:
+            matcher = KeywordMatcher(keywords)
+        return [matcher.find_all(text) for text in texts], matcher
+
+    async def _match_fallback(
+        self,
+        key: str,
+        keywords: List[str],
+        texts: List[str]
+    ) -> List[List[KeywordHit]]:
+        # Автомат строится и текст сопоставляется в потоке, цикл не
+        # блокируется и при отказе процессов
+        loop = asyncio.get_running_loop()
+        results, matcher = await loop.run_in_executor(
+            None,
+            self._match_local,
+            key,
+            keywords,
+            texts
+        )
+        self._fallback[key] = matcher
+        self._fallback.move_to_end(key)
+        while len(self._fallback) > KEYWORD_SETS:
+            self._fallback.popitem(last=False)
+        self.fallbacks += 1
+        return results
+
+    async def _dispatch(
+        self,
+        key: str,
+        keywords: List[str],
+        batch: List[Tuple[str, asyncio.Future]]
+    ):
+        texts = [text for text, _ in batch]
+        if not keywords:
+            results = [[] for _ in texts]
+        else:
+            results = None
+            worker = await self._idle.get()
+            try:
+                results = await self._request(worker, key, keywords, texts)
+            except Exception as e:
+                logger.error(f"Match worker error: {e!r}, restarting it")
+                try:
+                    worker = await self._restart(worker)
+                    results = await self._request(
+                        worker, key, keywords, texts
+                    )
+                except Exception as e:
+                    logger.error(f"Match worker restart failed: {e!r}")
+            finally:
+                self._idle.put_nowait(worker)
+
+            if results is None:
+                # Пачка сопоставляется без процессов, чтобы не потерять
+                # сообщения
+                results = await self._match_fallback(key, keywords, texts)
+
+        self.batches += 1
+        self.texts += len(batch)
+        for (_, future), hits in zip(batch, results):
+            if not future.done():
+                future.set_result(hits)
+
+    def get_stats(self):
+        return {
+            "workers": len(self._workers),
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch": self.texts / self.batches if self.batches else 0.0,
+            "restarts": self.restarts,
+            "fallbacks": self.fallbacks,
+        }
+
+
+match_pool = MatchPool(
+    settings.MATCH_WORKERS,
+    settings.MATCH_BATCH_SIZE,
+    settings.MATCH_BATCH_DELAY,
+    timeout=settings.MATCH_TIMEOUT
+)
+
+_local_matchers: "OrderedDict[str, KeywordMatcher]" = OrderedDict()
+
+
+async def keywords_matcher(keywords: List[str]) -> KeywordMatcher:
+    """Автомат для набора слов задачи без пула процессов, строится в
+    потоке"""
+    key = keyword_set_key(keywords)
+    matcher = _local_matchers.get(key)
+    if matcher is None:
+        loop = asyncio.get_running_loop()
+        matcher = await loop.run_in_executor(
+            None,
+            KeywordMatcher,
+            list(keywords)
+        )
+        _local_matchers[key] = matcher
+    _local_matchers.move_to_end(key)
+    while len(_local_matchers) > KEYWORD_SETS:
+        _local_matchers.popitem(last=False)
+    return matcher
+
+
+async def match_texts(
+    texts: List[str],
+    keywords: Optional[List[str]] = None
+) -> List[List[KeywordHit]]:
+    """Сопоставляет тексты с ключевыми словами: в пуле процессов, если
+    он запущен, иначе в текущем цикле. keywords - набор слов задачи,
+    по умолчанию текущие слова бота"""
+    if match_pool.is_running:
+        return await match_pool.find_all_many(texts, keywords)
+    if keywords is None:
+        matcher = await get_matcher()
+    else:
+        matcher = await keywords_matcher(keywords)
+    return [matcher.find_all(text) for text in texts]
+
+
+async def match_text(text: str) -> List[KeywordHit]:
+    """Сопоставляет текст с текущими ключевыми словами бота"""
+    if match_pool.is_running:
+        return await match_pool.find_all(text)
+    return (await match_texts([text]))[0]
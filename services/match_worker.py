@@ -0,0 +1,60 @@
+"""Процесс сопоставления ключевых слов для services.match_pool.
+
+Запускается как python -m services.match_worker и импортирует только
+автомат, без конфигурации и данных бота. Команды и ответы передаются
+через stdin/stdout кадрами: длина (4 байта) и pickle."""
+import pickle
+import struct
+import sys
+from typing import BinaryIO, Dict
+from services.keyword_matcher import KeywordMatcher
+
+
+FRAME_HEADER = struct.Struct(">I")
+
+
+def read_frame(stream: BinaryIO):
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError("Match worker pipe closed")
+    (length,) = FRAME_HEADER.unpack(header)
+    data = stream.read(length)
+    if len(data) < length:
+        raise EOFError("Match worker pipe closed")
+    return pickle.loads(data)
+
+
+def write_frame(stream: BinaryIO, payload):
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(FRAME_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def main():
+    requests = sys.stdin.buffer
+    responses = sys.stdout.buffer
+    # Случайный print не должен попасть в канал ответов
+    sys.stdout = sys.stderr
+
+    # Автоматы по ключам наборов слов, набор удаляется командой forget
+    matchers: Dict[str, KeywordMatcher] = {}
+    while True:
+        try:
+            command, payload = read_frame(requests)
+        except EOFError:
+            return
+        if command == "keywords":
+            key, keywords = payload
+            matchers[key] = KeywordMatcher(keywords)
+        elif command == "forget":
+            matchers.pop(payload, None)
+        elif command == "match":
+            key, texts = payload
+            matcher = matchers[key]
+            write_frame(responses, [matcher.find_all(text) for text in texts])
+        elif command == "stop":
+            return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,59 @@
+import asyncio
+import html
+import time
+from collections import deque
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import settings
+from core.bot import bot
+from core.database import OutboxItem, outbox
+from services.keyword_matcher import KeywordHit
+from utils.logger import logger
+
+
+PREVIEW_LENGTH = 200
+PREVIEW_CONTEXT = 60
+
+
+def format_preview(message_text: str, hits: List[KeywordHit]) -> str:
+    """Фрагмент сообщения вокруг первого совпадения с подсветкой
+    всех найденных ключевых слов"""
+    spans: List[Tuple[int, int]] = sorted(
+        span for hit in hits for span in hit.spans
+    )
+
+    start = 0
+    if spans:
+        start = max(0, spans[0][0] - PREVIEW_CONTEXT)
+    end = min(len(message_text), start + PREVIEW_LENGTH)
+    start = max(0, min(start, end - PREVIEW_LENGTH))
+
+    preview = "..." if start > 0 else ""
+    position = start
+    for span_start, span_end in spans:
+        span_start = max(span_start, position)
+        span_end = min(span_end, end)
+        if span_start >= span_end:
+            continue
+        preview += html.escape(message_text[position:span_start])
+        preview += f"<b>{html.escape(message_text[span_start:span_end])}</b>"
+        position = span_end
+    preview += html.escape(message_text[position:end])
+
+    if end < len(message_text):
+        preview += "..."
+    return preview
 
 
 def format_notification(
-    keyword: str,
+    hits: List[KeywordHit],
     sender_id: int,
     sender_name: str,
     sender_username: Optional[str],
@@ -12,14 +62,26 @@ def format_notification(
     source_username: Optional[str],
     message_text: str,
     message_link: Optional[str] = None,
-    parent_channel: Optional[str] = None
+    parent_channel: Optional[str] = None,
+    edited: bool = False
 ) -> tuple[str, Optional[InlineKeyboardMarkup]]:
 
-    text = "🔔 <b>Найдено ключевое слово!</b>\n\n"
-    text += f"🔑 <b>Ключевое слово:</b> {keyword}\n\n"
+    if len(hits) > 1:
+        text = "🔔 <b>Найдены ключевые слова!</b>\n\n"
+        text += "🔑 <b>Ключевые слова:</b> "
+    else:
+        text = "🔔 <b>Найдено ключевое слово!</b>\n\n"
+        text += "🔑 <b>Ключевое слово:</b> "
+    text += ", ".join(
+        html.escape(hit.keyword) + (
+            f" (×{len(hit.spans)})" if len(hit.spans) > 1 else ""
+        )
+        for hit in hits
+    )
+    text += "\n\n"
 
     text += "👤 <b>Отправитель:</b>\n"
-    text += f"├ Имя: {sender_name}\n"
+    text += f"├ Имя: {html.escape(sender_name)}\n"
     if sender_username:
         text += f"├ Username: @{sender_username}\n"
     text += f"└ ID: <code>{sender_id}</code>\n\n"
@@ -33,19 +95,18 @@ def format_notification(
     elif source_type == "discussion":
         text += "├ Тип: Комментарий в канале\n"
         if parent_channel:
-            text += f"├ Канал: {parent_channel}\n"
+            text += f"├ Канал: {html.escape(parent_channel)}\n"
 
-    text += f"├ Название: {source_title}\n"
+    text += f"├ Название: {html.escape(source_title)}\n"
     if source_username:
         text += f"└ Username: @{source_username}\n"
     else:
         text += "└ Username: Нет\n"
 
+    if edited:
+        text += "\n✏️ <b>Сообщение отредактировано</b>\n"
     text += "\n📝 <b>Сообщение:</b>\n"
-    preview = message_text[:200]
-    if len(message_text) > 200:
-        preview += "..."
-    text += f"<i>{preview}</i>"
+    text += f"<i>{format_preview(message_text, hits)}</i>"
 
     # Создаем кнопки
     keyboard = None
@@ -82,3 +143,223 @@ def format_notification(
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
 
     return text, keyboard
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(
+            self.blocked_until,
+            time.monotonic() + seconds
+        )
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class NotificationSender:
+    """Центральная отправка уведомлений: общий и поштучный по чатам
+    лимит, повторы при RetryAfter и сетевых ошибках"""
+
+    RATE_WINDOW = 60.0
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_retries: int
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._sent_times: deque = deque()
+
+        self.sent = 0
+        self.retries = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+
+            try:
+                result = await bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                logger.warning(
+                    f"RetryAfter {e.retry_after}s for chat {chat_id}"
+                )
+                chat_bucket.pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failed += 1
+                    raise
+                delay = min(2 ** attempt, 60)
+                logger.warning(
+                    f"Send to {chat_id} failed ({e}), "
+                    f"retry {attempt} in {delay}s"
+                )
+                chat_bucket.pause(delay)
+            except Exception:
+                self.failed += 1
+                raise
+            else:
+                self._record_sent()
+                return result
+
+            self.retries += 1
+
+    def _record_sent(self):
+        now = time.monotonic()
+        self.sent += 1
+        self._sent_times.append(now)
+        while self._sent_times[0] < now - self.RATE_WINDOW:
+            self._sent_times.popleft()
+
+    def get_stats(self) -> Dict:
+        now = time.monotonic()
+        while self._sent_times and (
+            self._sent_times[0] < now - self.RATE_WINDOW
+        ):
+            self._sent_times.popleft()
+
+        return {
+            "sent": self.sent,
+            "retries": self.retries,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "rate": len(self._sent_times) / self.RATE_WINDOW,
+        }
+
+
+notification_sender = NotificationSender(
+    settings.NOTIFY_GLOBAL_RATE,
+    settings.NOTIFY_CHAT_RATE,
+    settings.NOTIFY_CHAT_BURST,
+    settings.NOTIFY_MAX_RETRIES
+)
+
+
+async def enqueue_notification(
+    chat_ids: Iterable[int],
+    text: str,
+    keyboard: Optional[InlineKeyboardMarkup] = None
+):
+    """Сохраняет уведомление в outbox, доставку выполняет
+    run_outbox_delivery"""
+    markup = None
+    if keyboard:
+        markup = keyboard.model_dump_json(exclude_none=True)
+    await outbox.enqueue_many(
+        [(chat_id, text, markup) for chat_id in chat_ids]
+    )
+
+
+async def _deliver(item: OutboxItem) -> Optional[bool]:
+    """True - доставлено, False - повторить позже,
+    None - доставка невозможна"""
+    reply_markup = None
+    if item.reply_markup:
+        reply_markup = InlineKeyboardMarkup.model_validate_json(
+            item.reply_markup
+        )
+
+    try:
+        await notification_sender.send(
+            item.chat_id,
+            item.text,
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+        return True
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        logger.error(
+            f"Notification {item.id} to {item.chat_id} dropped: {e}"
+        )
+        return None
+    except Exception as e:
+        logger.error(f"Error delivering notification {item.id}: {e}")
+        if item.attempts + 1 >= settings.OUTBOX_MAX_ATTEMPTS:
+            logger.error(
+                f"Notification {item.id} dropped after "
+                f"{item.attempts + 1} attempts"
+            )
+            return None
+        return False
+
+
+async def run_outbox_delivery():
+    logger.info("Outbox delivery started")
+
+    while True:
+        try:
+            items = await outbox.fetch(settings.OUTBOX_BATCH_SIZE)
+            if not items:
+                await outbox.wait(settings.OUTBOX_POLL_INTERVAL)
+                continue
+
+            results = await asyncio.gather(
+                *(_deliver(item) for item in items)
+            )
+
+            await outbox.ack([
+                item.id for item, delivered in zip(items, results)
+                if delivered is not False
+            ])
+
+            failed = [
+                item for item, delivered in zip(items, results)
+                if delivered is False
+            ]
+            if failed:
+                delay = min(2 ** max(item.attempts for item in failed), 300)
+                await outbox.retry_later(
+                    [item.id for item in failed],
+                    delay
+                )
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbox delivery error: {e}")
+            await asyncio.sleep(settings.OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,86 @@
+import asyncio
+import time
+import weakref
+from typing import Dict
+from config import settings
+from utils.logger import logger
+
+
+class AdaptivePacer:
+    """Темп запросов истории для одного аккаунта (AIMD).
+
+    Каждый успешный запрос немного увеличивает допустимую частоту,
+    FloodWait уменьшает ее вдвое и приостанавливает все сканирования
+    аккаунта на указанное Telegram время."""
+
+    def __init__(
+        self,
+        initial_delay: float,
+        min_delay: float,
+        max_delay: float,
+        increase_step: float = 0.05
+    ):
+        self.min_rate = 1 / max_delay
+        self.max_rate = 1 / min_delay
+        initial_delay = min(max(initial_delay, min_delay), max_delay)
+        self.rate = 1 / initial_delay
+        self.increase_step = increase_step
+        self._next_at = 0.0
+        self._blocked_until = 0.0
+
+        self.requests = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+
+    async def wait(self):
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            slot = max(now, self._next_at)
+            self._next_at = slot + 1 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            return
+
+    def on_success(self):
+        self.requests += 1
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_flood_wait(self, seconds: int):
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._blocked_until = max(
+            self._blocked_until,
+            time.monotonic() + seconds
+        )
+        logger.warning(
+            f"FloodWait {seconds}s, history rate lowered to "
+            f"{self.rate:.2f} req/s"
+        )
+
+    def get_stats(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "requests": self.requests,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
+
+
+_pacers: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def get_pacer(client) -> AdaptivePacer:
+    pacer = _pacers.get(client)
+    if pacer is None:
+        pacer = AdaptivePacer(
+            settings.BATCH_DELAY,
+            settings.HISTORY_MIN_DELAY,
+            settings.HISTORY_MAX_DELAY
+        )
+        _pacers[client] = pacer
+    return pacer
@@ -0,0 +1,81 @@
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+from core.database import data_manager
+
+
+class SourceProgress:
+    """Продвижение pts и last_message_id источников.
+
+    Сообщение, принятое в обработку (begin), удерживает позицию
+    источника до своего завершения (finish): сохраняются только pts и
+    id до первого сообщения, которое еще ждет в очереди или
+    обрабатывается. После сбоя такие сообщения снова получают
+    восстановление пропусков и инкрементальная загрузка истории."""
+
+    def __init__(self):
+        self._tokens = count(1)
+        self._pending: Dict[
+            int, Dict[int, Tuple[Optional[int], Optional[int]]]
+        ] = {}
+        self._latest: Dict[int, List[int]] = {}
+
+    def begin(
+        self,
+        chat_id: int,
+        message_id: Optional[int] = None,
+        pts: Optional[int] = None,
+        pts_count: int = 0
+    ) -> int:
+        """Принимает сообщение в обработку. message_id - для новых
+        сообщений (правки не сдвигают last_message_id), pts и
+        pts_count - из апдейта канала"""
+        token = next(self._tokens)
+        self._pending.setdefault(chat_id, {})[token] = (
+            message_id,
+            pts - pts_count if pts is not None else None
+        )
+        self.advance(chat_id, message_id, pts)
+        return token
+
+    def finish(self, chat_id: int, token: int):
+        pending = self._pending.get(chat_id)
+        if pending is not None:
+            pending.pop(token, None)
+            if not pending:
+                del self._pending[chat_id]
+        self._commit(chat_id)
+
+    def advance(
+        self,
+        chat_id: int,
+        message_id: Optional[int] = None,
+        pts: Optional[int] = None
+    ):
+        """Учитывает позицию, не требующую обработки (апдейт без
+        текста, итог getChannelDifference)"""
+        latest = self._latest.setdefault(chat_id, [0, 0])
+        if message_id is not None and message_id > latest[0]:
+            latest[0] = message_id
+        if pts is not None and pts > latest[1]:
+            latest[1] = pts
+        self._commit(chat_id)
+
+    def _commit(self, chat_id: int):
+        latest = self._latest.get(chat_id)
+        if latest is None:
+            return
+        message_id, pts = latest
+        for pending_id, pending_pts in self._pending.get(chat_id, {}).values():
+            if pending_id is not None:
+                message_id = min(message_id, pending_id - 1)
+            if pending_pts is not None:
+                pts = min(pts, pending_pts)
+
+        # Оба значения монотонны, меньшие сохраненных игнорируются
+        if message_id > 0:
+            data_manager.update_source_watermark(chat_id, message_id)
+        if pts > 0:
+            data_manager.update_source_pts(chat_id, pts)
+
+
+source_progress = SourceProgress()